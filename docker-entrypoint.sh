@@ -1,19 +1,32 @@
 #!/bin/sh
 
-echo "Setup Schema"
-flask setup_schema
+# migrations are run by a single container, others (e.g. the ingest worker) wait for them
+if [ "$RUN_MIGRATIONS" != "False" ]; then
+  echo "Setup Schema"
+  flask setup_schema
 
-echo "Running Migrations"
-flask db upgrade
+  echo "Running Migrations"
+  flask db upgrade
 
-echo "Create PG Function"
-flask create_pg_function
+  echo "Create PG Function"
+  flask create_pg_function
+else
+  echo "Waiting for migrations"
+  until flask db current 2>/dev/null | grep -q "(head)"; do
+    sleep 5
+  done
+fi
+
+echo "Compile BUFR code tables"
+flask compile_codetables
 
 #ensure environment-variables are available for cronjob
 printenv | grep -v "no_proxy" >>/etc/environment
 
-# ensure cron is running
-service cron start
-service cron status
+# ensure cron is running, unless disabled (e.g. for the ingest worker)
+if [ "$ENABLE_CRON" != "False" ]; then
+  service cron start
+  service cron status
+fi
 
 exec "$@"
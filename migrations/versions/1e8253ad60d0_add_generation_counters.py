@@ -0,0 +1,34 @@
+"""add generation counters
+
+Revision ID: 1e8253ad60d0
+Revises: 7aa2e376349b
+Create Date: 2026-10-18 15:10:52.884213
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e8253ad60d0'
+down_revision = '7aa2e376349b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('synop_generation',
+    sa.Column('name', sa.String(length=64), nullable=False),
+    sa.Column('value', sa.BigInteger(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+    op.execute("""
+        INSERT INTO synop_generation (name, value, updated_at)
+        VALUES ('observations', 1, now() AT TIME ZONE 'UTC'), ('stations', 1, now() AT TIME ZONE 'UTC')
+    """)
+
+
+def downgrade():
+    op.drop_table('synop_generation')
@@ -0,0 +1,27 @@
+"""add observation time index
+
+Revision ID: 4b37ddccbda5
+Revises: 1e8253ad60d0
+Create Date: 2026-10-18 18:02:36.114520
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b37ddccbda5'
+down_revision = '1e8253ad60d0'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # created on the partitioned table, so existing and future partitions get it
+    with op.batch_alter_table('synop_observation', schema=None) as batch_op:
+        batch_op.create_index('idx_synop_observation_time_wigos_id', ['time', 'wigos_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('synop_observation', schema=None) as batch_op:
+        batch_op.drop_index('idx_synop_observation_time_wigos_id')
@@ -0,0 +1,48 @@
+"""add timestep catalogue
+
+Revision ID: 562da94afcc3
+Revises: 94960fc298a4
+Create Date: 2026-10-18 13:05:41.208377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '562da94afcc3'
+down_revision = '94960fc298a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('synop_timestep',
+    sa.Column('time', sa.DateTime(), nullable=False),
+    sa.Column('station_count', sa.Integer(), nullable=False),
+    sa.Column('observation_count', sa.Integer(), nullable=False),
+    sa.Column('parameter_count', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('time')
+    )
+
+    # catalogue the timesteps already loaded
+    parameters = [
+        row[0] for row in op.get_bind().execute(sa.text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'synop_observation'
+              AND column_name NOT IN ('id', 'wigos_id', 'time')
+        """))
+    ]
+    parameter_count = " + ".join(f"(count({column}) > 0)::int" for column in parameters) or "0"
+
+    op.execute(f"""
+        INSERT INTO synop_timestep (time, station_count, observation_count, parameter_count, updated_at)
+        SELECT time, count(DISTINCT wigos_id), count(*), {parameter_count}, now()
+        FROM synop_observation
+        GROUP BY time
+    """)
+
+
+def downgrade():
+    op.drop_table('synop_timestep')
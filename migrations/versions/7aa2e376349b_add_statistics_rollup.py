@@ -0,0 +1,63 @@
+"""add statistics rollup
+
+Revision ID: 7aa2e376349b
+Revises: 562da94afcc3
+Create Date: 2026-10-18 14:22:17.530946
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7aa2e376349b'
+down_revision = '562da94afcc3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('synop_statistics',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=False),
+    sa.Column('territory', sa.String(length=256), nullable=True),
+    sa.Column('parameter', sa.String(length=256), nullable=False),
+    sa.Column('station_count', sa.Integer(), nullable=False),
+    sa.Column('minimum', sa.Float(), nullable=True),
+    sa.Column('maximum', sa.Float(), nullable=True),
+    sa.Column('mean', sa.Float(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('synop_statistics', schema=None) as batch_op:
+        batch_op.create_index('idx_synop_statistics_time_parameter', ['time', 'parameter'], unique=False)
+
+    # roll up the observations already loaded
+    parameters = [
+        row[0] for row in op.get_bind().execute(sa.text("""
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'synop_observation'
+              AND column_name NOT IN ('id', 'wigos_id', 'time')
+        """))
+    ]
+
+    if not parameters:
+        return
+
+    parameter_values = ", ".join(f"('{column}', o.{column})" for column in parameters)
+
+    op.execute(f"""
+        INSERT INTO synop_statistics (time, territory, parameter, station_count, minimum, maximum, mean)
+        SELECT o.time, coalesce(s.territory, ''), p.parameter, count(*), min(p.value), max(p.value), avg(p.value)
+        FROM synop_observation o
+        JOIN synop_station s ON s.wigos_id = o.wigos_id
+        CROSS JOIN LATERAL (VALUES {parameter_values}) AS p(parameter, value)
+        WHERE p.value IS NOT NULL
+        GROUP BY o.time, s.territory, p.parameter
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('synop_statistics', schema=None) as batch_op:
+        batch_op.drop_index('idx_synop_statistics_time_parameter')
+
+    op.drop_table('synop_statistics')
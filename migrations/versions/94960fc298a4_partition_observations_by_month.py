@@ -0,0 +1,78 @@
+"""partition observations by month
+
+Revision ID: 94960fc298a4
+Revises: d37386aed932
+Create Date: 2026-10-18 14:05:52.913448
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '94960fc298a4'
+down_revision = 'd37386aed932'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("ALTER TABLE synop_observation RENAME TO synop_observation_old")
+    op.execute("ALTER TABLE synop_observation_old RENAME CONSTRAINT synop_observation_pkey TO synop_observation_old_pkey")
+    op.execute("ALTER TABLE synop_observation_old RENAME CONSTRAINT unique_station_time TO unique_station_time_old")
+    # keep the id sequence when the old table is dropped
+    op.execute("ALTER SEQUENCE synop_observation_id_seq OWNED BY NONE")
+
+    op.execute("""
+        CREATE TABLE synop_observation (LIKE synop_observation_old INCLUDING DEFAULTS)
+        PARTITION BY RANGE (time)
+    """)
+    op.execute("ALTER SEQUENCE synop_observation_id_seq OWNED BY synop_observation.id")
+    op.create_primary_key('synop_observation_pkey', 'synop_observation', ['id', 'time'])
+    op.create_unique_constraint('unique_station_time', 'synop_observation', ['wigos_id', 'time'])
+    op.create_foreign_key('synop_observation_wigos_id_fkey', 'synop_observation', 'synop_station',
+                          ['wigos_id'], ['wigos_id'], ondelete='CASCADE')
+
+    # one partition per month of existing data, plus the current and next month
+    op.execute("""
+        DO
+        $do$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', LEAST(COALESCE(min(time), now()), now())),
+                    date_trunc('month', GREATEST(COALESCE(max(time), now()), now())) + interval '1 month',
+                    interval '1 month'
+                )::date
+                FROM synop_observation_old
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE IF NOT EXISTS %I PARTITION OF synop_observation FOR VALUES FROM (%L) TO (%L)',
+                    'synop_observation_' || to_char(month, '"y"YYYY"m"MM'), month, month + interval '1 month'
+                );
+            END LOOP;
+        END
+        $do$;
+    """)
+
+    op.execute("INSERT INTO synop_observation SELECT * FROM synop_observation_old")
+    op.drop_table('synop_observation_old')
+
+
+def downgrade():
+    op.execute("ALTER TABLE synop_observation RENAME TO synop_observation_partitioned")
+    op.execute("ALTER TABLE synop_observation_partitioned RENAME CONSTRAINT synop_observation_pkey TO synop_observation_partitioned_pkey")
+    op.execute("ALTER TABLE synop_observation_partitioned RENAME CONSTRAINT unique_station_time TO unique_station_time_partitioned")
+    op.execute("ALTER SEQUENCE synop_observation_id_seq OWNED BY NONE")
+
+    op.execute("CREATE TABLE synop_observation (LIKE synop_observation_partitioned INCLUDING DEFAULTS)")
+    op.execute("ALTER SEQUENCE synop_observation_id_seq OWNED BY synop_observation.id")
+    op.create_primary_key('synop_observation_pkey', 'synop_observation', ['id'])
+    op.create_unique_constraint('unique_station_time', 'synop_observation', ['wigos_id', 'time'])
+    op.create_foreign_key('synop_observation_wigos_id_fkey', 'synop_observation', 'synop_station',
+                          ['wigos_id'], ['wigos_id'], ondelete='CASCADE')
+
+    op.execute("INSERT INTO synop_observation SELECT * FROM synop_observation_partitioned")
+    op.execute("DROP TABLE synop_observation_partitioned CASCADE")
@@ -0,0 +1,33 @@
+"""unique station identifier
+
+Revision ID: a83d9ee3262e
+Revises: 6c352318bd43
+Create Date: 2026-10-18 09:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a83d9ee3262e'
+down_revision = '6c352318bd43'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # remove duplicate identifiers, keeping the first one loaded
+    op.execute("""
+        DELETE FROM synop_station_identifier a
+        USING synop_station_identifier b
+        WHERE a.identifier = b.identifier AND a.id > b.id
+    """)
+
+    with op.batch_alter_table('synop_station_identifier', schema=None) as batch_op:
+        batch_op.create_unique_constraint('unique_station_identifier', ['identifier'])
+
+
+def downgrade():
+    with op.batch_alter_table('synop_station_identifier', schema=None) as batch_op:
+        batch_op.drop_constraint('unique_station_identifier', type_='unique')
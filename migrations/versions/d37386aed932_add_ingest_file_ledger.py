@@ -0,0 +1,55 @@
+"""add ingest file ledger
+
+Revision ID: d37386aed932
+Revises: a83d9ee3262e
+Create Date: 2026-10-18 11:40:05.627113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd37386aed932'
+down_revision = 'a83d9ee3262e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('synop_ingest_file',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=256), nullable=False),
+    sa.Column('time', sa.DateTime(), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=True),
+    sa.Column('content_hash', sa.String(length=64), nullable=True),
+    sa.Column('status', sa.String(length=32), nullable=False),
+    sa.Column('station_count', sa.Integer(), nullable=True),
+    sa.Column('observation_count', sa.Integer(), nullable=True),
+    sa.Column('failed_count', sa.Integer(), nullable=True),
+    sa.Column('decode_duration', sa.Float(), nullable=True),
+    sa.Column('load_duration', sa.Float(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('completed_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    with op.batch_alter_table('synop_ingest_file', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_synop_ingest_file_time'), ['time'], unique=False)
+
+    # record the timesteps already ingested, their content hash is unknown
+    op.execute("""
+        INSERT INTO synop_ingest_file (name, time, status, station_count, observation_count, completed_at)
+        SELECT 'SYNA0001_' || to_char(time, 'YYYYMMDDHH24MI') || '_180.DAT', time, 'done',
+               count(DISTINCT wigos_id), count(*), now()
+        FROM synop_observation
+        GROUP BY time
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('synop_ingest_file', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_synop_ingest_file_time'))
+
+    op.drop_table('synop_ingest_file')
@@ -46,6 +46,8 @@ sys.excepthook = handle_exception
 # Config
 app.config['SQLALCHEMY_DATABASE_URI'] = SETTINGS.get('SQLALCHEMY_DATABASE_URI')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# long running commands keep connections open, check them before use
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_pre_ping': True}
 
 # pagination
 app.config['ITEMS_PER_PAGE'] = SETTINGS.get('ITEMS_PER_PAGE', 20)
@@ -116,5 +118,7 @@ from synop import commands
 
 app.cli.add_command(commands.load_stations)
 app.cli.add_command(commands.load_observations)
+app.cli.add_command(commands.ingest_worker)
 app.cli.add_command(commands.setup_schema)
 app.cli.add_command(commands.create_pg_function)
+app.cli.add_command(commands.compile_codetables)
@@ -25,19 +25,21 @@ import csv
 import hashlib
 import json
 import logging
+import mmap
 import os.path
 import re
-import tempfile
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 from datetime import datetime, timedelta
+from itertools import repeat
 from pathlib import Path
 from typing import Iterator, Union
 
 import numpy as np
 from cfunits import Units
-from eccodes import (codes_bufr_new_from_file, codes_clone,
-                     codes_get_array, codes_set,
+from eccodes import (codes_new_from_message, codes_clone,
+                     codes_get_array, codes_set, codes_get_message,
                      codes_release, codes_get,
                      CODES_MISSING_LONG, CODES_MISSING_DOUBLE,
                      codes_bufr_keys_iterator_new,
@@ -57,6 +59,10 @@ BUFR_TABLE_VERSION = 37  # default BUFR table version
 THISDIR = os.path.dirname(os.path.realpath(__file__))
 RESOURCES = f"{THISDIR}{os.sep}resources"
 CODETABLES = {}
+# compiled code tables, see `compile_codetables`
+CODETABLE_INDEX_DIR = os.environ.get("CODETABLE_INDEX_DIR",
+                                     f"{RESOURCES}{os.sep}codetables")
+CODETABLE_INDEX = None
 
 ECCODES_DEFINITION_PATH = codes_definition_path()
 if not os.path.exists(ECCODES_DEFINITION_PATH):
@@ -74,8 +80,15 @@ PREFERRED_UNITS = {
     "Pa": "hPa"
 }
 
+# affine coefficients (scale, offset) for converting to the preferred units,
+# computed once per unit pair the first time that they are used.
+UNIT_CONVERSIONS = dict()
+
 # list of BUFR attributes
 ATTRIBUTES = ['code', 'units', 'scale', 'reference', 'width']
+# attributes that operators (e.g. 2-07, 2-03) can change between messages
+# sharing a template, these are read per message rather than cached
+MESSAGE_ATTRIBUTES = ['scale', 'reference', 'width']
 
 # list of ecCodes keys for BUFR headers
 HEADERS = ["edition", "masterTableNumber", "bufrHeaderCentre",
@@ -122,12 +135,145 @@ ID_DESCRIPTORS = ["block_number", "station_number",
 # they are used.
 jsonpath_parsers = dict()
 
+# compiled element plans, keyed by table version and unexpanded descriptors
+# and then by expanded descriptors. Populated the first time a template is
+# seen.
+PLANS = dict()
+PLAN_CACHE_SIZE = 32  # maximum number of plans per template
+
+
+# class to provide read-only access to the compiled code tables
+class CodeTableIndex:
+    def __init__(self, path: Union[str, Path]):
+        """
+        Loads a code table index written by `compile_codetables`. The arrays
+        are memory mapped so loading is independent of the index size and
+        the pages are shared between processes.
+
+        :param path: directory containing the compiled index
+        """
+
+        path = Path(path)
+        self.versions = set(np.load(path / "versions.npy").tolist())
+        self.keys = np.load(path / "keys.npy", mmap_mode="r")
+        self.offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.blob = np.load(path / "blob.npy", mmap_mode="r")
+
+    def __contains__(self, table_version: int) -> bool:
+        return table_version in self.versions
+
+    def get(self, table_version: int, table: int, code: int) -> Union[str, None]:  # noqa
+        """
+        Gets decoded value for a code table entry
+
+        :param table_version: BUFR master table version
+        :param table: code table number (integer form of FXXYYY)
+        :param code: value to decode
+
+        :returns: string representation of coded value or None if the entry
+                  does not exist
+        """
+
+        key = codetable_key(table_version, table, code)
+        idx = int(np.searchsorted(self.keys, key))
+        if idx == len(self.keys) or self.keys[idx] != key:
+            return None
+
+        start, end = self.offsets[idx], self.offsets[idx + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+
+def codetable_key(table_version: int, table: int, code: int) -> int:
+    """
+    Packs a code table entry into the integer key used by `CodeTableIndex`
+
+    :param table_version: BUFR master table version
+    :param table: code table number (integer form of FXXYYY)
+    :param code: value in code table
+
+    :returns: integer key
+    """
+
+    return (int(table_version) << 48) | (int(table) << 24) | int(code)
+
+
+def compile_codetables(output_dir: Union[str, Path],
+                       versions: list = None) -> int:
+    """
+    Compiles the ecCodes code tables into a single index that can be loaded
+    with `CodeTableIndex`. Entries are stored as a sorted array of integer
+    keys, with the decoded values concatenated into a byte blob.
+
+    :param output_dir: directory to write the index to
+    :param versions: BUFR master table versions to compile (default is all
+                     versions available in ecCodes)
+
+    :returns: number of entries compiled
+    """
+
+    if versions is None:
+        versions = sorted(int(p.name) for p in TABLEDIR.iterdir()
+                          if p.name.isdigit() and
+                          (p / "codetables").is_dir())
+
+    entries = {}
+    for version in versions:
+        LOGGER.debug(f"Compiling code tables for table version {version}")
+        for tablefile in (TABLEDIR / str(version) / "codetables").glob("*.table"):  # noqa
+            if not tablefile.stem.isdigit():
+                continue
+            table = int(tablefile.stem)
+            with tablefile.open() as csvfile:
+                reader = csv.reader(csvfile, delimiter=" ")
+                for row in reader:
+                    key = codetable_key(version, table, int(row[0]))
+                    entries[key] = row[2].encode("utf-8")
+
+    keys = np.array(sorted(entries), dtype=np.int64)
+    values = [entries[key] for key in keys.tolist()]
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(value) for value in values])
+    blob = np.frombuffer(b"".join(values), dtype=np.uint8)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    np.save(output_dir / "keys.npy", keys)
+    np.save(output_dir / "offsets.npy", offsets)
+    np.save(output_dir / "blob.npy", blob)
+    # written last, the index is only used once the versions are present
+    np.save(output_dir / "versions.npy", np.array(versions, dtype=np.int64))
+
+    LOGGER.info(f"Compiled {len(keys)} code table entries to {output_dir}")
+
+    return len(keys)
+
+
+def get_codetable_index() -> Union[CodeTableIndex, None]:
+    """
+    Gets the compiled code table index, loading it the first time that it is
+    used
+
+    :returns: `CodeTableIndex` or None if no index has been compiled
+    """
+
+    global CODETABLE_INDEX
+
+    if CODETABLE_INDEX is None:
+        if not os.path.exists(os.path.join(CODETABLE_INDEX_DIR, "versions.npy")):  # noqa
+            return None
+        LOGGER.debug(f"Loading code table index from {CODETABLE_INDEX_DIR}")
+        CODETABLE_INDEX = CodeTableIndex(CODETABLE_INDEX_DIR)
+
+    return CODETABLE_INDEX
+
 
 # class to act as parser for BUFR data
 class BUFRParser:
     def __init__(self, raise_on_error=False):
 
         self.raise_on_error = raise_on_error
+        # number of subsets that could not be converted
+        self.failed = 0
 
         # dict to store qualifiers in force and for accounting
         self.qualifiers = {
@@ -554,6 +700,15 @@ class BUFRParser:
             return None
         table = int(fxxyyy)
 
+        index = get_codetable_index()
+        if index is not None and self.table_version in index:
+            decoded = index.get(self.table_version, table, code)
+            if decoded is None:
+                LOGGER.warning(
+                    f"Invalid entry for value {code} in code table {fxxyyy}, table version {self.table_version}")  # noqa
+                decoded = "Invalid"
+            return decoded
+
         if self.table_version not in CODETABLES:
             CODETABLES[self.table_version] = {}
 
@@ -574,27 +729,25 @@ class BUFRParser:
 
         return decoded
 
-    def as_geojson(self, bufr_handle: int, id: str,
-                   serialize: bool = False) -> dict:
+    def reset(self) -> None:
         """
-        Function to return GeoJSON representation of BUFR message
-
-        :param bufr_handle: integer handle for BUFR data (used by eccodes)
-        :param id: id to assign to feature collection
-        :param serialize: whether to return as JSON string (default is False)
+        Clears all qualifiers in force, used between subsets
 
-        :returns: dictionary containing GeoJSON feature collection
+        :returns: None
         """
 
-        # check we have data
-        if not bufr_handle:
-            LOGGER.warning("Empty BUFR")
-            return {}
+        for xx in self.qualifiers:
+            self.qualifiers[xx] = {}
 
-        LOGGER.debug(f"Processing {id}")
+    def get_headers(self, bufr_handle: int) -> OrderedDict:
+        """
+        Reads the BUFR headers and the unexpanded descriptor sequence from an
+        unpacked message and sets the table version used for code tables
 
-        # unpack the message
-        codes_set(bufr_handle, "unpack", True)
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+
+        :returns: dictionary containing headers and descriptor sequence
+        """
 
         # get table version
         try:
@@ -605,14 +758,6 @@ class BUFRParser:
             LOGGER.error(e)
             raise e
 
-        # get number of subsets
-        nsubsets = codes_get(bufr_handle, "numberOfSubsets")
-        LOGGER.debug(f"as_geojson.nsubsets: {nsubsets}")
-        try:
-            assert nsubsets == 1
-        except Exception:
-            LOGGER.error(f"Too many subsets in call to as_geojson ({nsubsets})")  # noqa
-
         # Load headers
         headers = OrderedDict()
         for header in HEADERS:
@@ -625,9 +770,6 @@ class BUFRParser:
                 LOGGER.error(f"Error reading {header}")
                 raise e
 
-        characteristic_date = headers["typicalDate"]
-        characteristic_time = headers["typicalTime"]
-
         try:
             sequence = codes_get_array(bufr_handle, UNEXPANDED_DESCRIPTORS[0])
         except Exception as e:
@@ -640,59 +782,328 @@ class BUFRParser:
         headers["sequence"] = sequence
         LOGGER.debug(sequence)
 
+        return headers
+
+    def get_plan(self, bufr_handle: int, headers: dict) -> list:
+        """
+        Gets the compiled plan for the data elements of an unpacked message.
+        Plans are cached by table version and unexpanded descriptor sequence
+        so that the element codes, units and names are only read from
+        ecCodes for the first message using a given template. As delayed
+        replication changes the element keys, the expanded descriptors are
+        used to tell apart messages sharing a sequence. Scale, reference and
+        width are not part of the plan, see `get_elements`.
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param headers: BUFR headers from `get_headers`
+
+        :returns: `list` of elements, each a dictionary containing the ecCodes
+                  key, FXXYYY code, class, attributes, normalised name and
+                  unit conversion coefficients (if any)
+        """
+
+        expanded = codes_get_array(bufr_handle, "expandedDescriptors")
+        signature = expanded.tobytes()
+
+        plans = PLANS.setdefault((self.table_version, headers["sequence"]),
+                                 OrderedDict())
+        if signature in plans:
+            return plans[signature]
+
+        LOGGER.debug(f"Compiling plan for sequence {headers['sequence']}")
+
+        plan = []
+
         # now get key iterator
         key_iterator = codes_bufr_keys_iterator_new(bufr_handle)
 
-        # set up data structures
-        data = {}
-        last_key = None
-        index = 0
-
-        # iterate over keys and add to dict
-        while codes_bufr_keys_iterator_next(key_iterator):
-            # get key
-            key = codes_bufr_keys_iterator_get_name(key_iterator)
-            # identify what we are processing
-            if key in (HEADERS + ECMWF_HEADERS + UNEXPANDED_DESCRIPTORS):
-                continue
-            else:  # data descriptor
-                try:
-                    fxxyyy = codes_get(bufr_handle, f"{key}->code")
-                except Exception as e:
-                    LOGGER.warning(f"Error reading {key}->code, skipping element: {e}")  # noqa
+        try:
+            # iterate over keys
+            while codes_bufr_keys_iterator_next(key_iterator):
+                # get key
+                key = codes_bufr_keys_iterator_get_name(key_iterator)
+                # identify what we are processing
+                if key in (HEADERS + ECMWF_HEADERS + UNEXPANDED_DESCRIPTORS):
                     continue
+                else:  # data descriptor
+                    try:
+                        fxxyyy = codes_get(bufr_handle, f"{key}->code")
+                    except Exception as e:
+                        LOGGER.warning(f"Error reading {key}->code, skipping element: {e}")  # noqa
+                        continue
+
+                # get attributes constant for the template
+                attributes = {}
+                for attribute in ATTRIBUTES:
+                    if attribute in MESSAGE_ATTRIBUTES:
+                        continue
+                    attribute_key = f"{key}->{attribute}"
+                    try:
+                        attribute_value = codes_get(bufr_handle, attribute_key)
+                    except Exception as e:
+                        LOGGER.warning(f"Error reading {attribute_key}: {e}")
+                        attribute_value = None
+                    if attribute_value is not None:
+                        attributes[attribute] = attribute_value
+
+                units = attributes.get("units")
+                conversion = None
+                if units in PREFERRED_UNITS:
+                    conversion = get_conversion(units, PREFERRED_UNITS[units])
+                    attributes["units"] = PREFERRED_UNITS[units]
+
+                # process key to something more sensible
+                name = re.sub("#[0-9]+#", "", key)
+                name = re.sub("([a-z])([A-Z])", r"\1_\2", name)
+                name = name.lower()
+
+                xx = int(fxxyyy[1:3])
+
+                plan.append({
+                    "key": key,
+                    "fxxyyy": fxxyyy,
+                    "xx": xx,
+                    "name": name,
+                    "units": units,
+                    "attributes": attributes,
+                    "conversion": conversion,
+                    # qualifiers carry their attributes into the output
+                    "qualifier": xx < 9 or fxxyyy == "022067"
+                })
+        finally:
+            codes_bufr_keys_iterator_delete(key_iterator)
+
+        if len(plans) >= PLAN_CACHE_SIZE:
+            plans.popitem(last=False)
+        plans[signature] = plan
+
+        return plan
+
+    def get_elements(self, bufr_handle: int,
+                     headers: dict) -> Iterator[tuple]:
+        """
+        Iterates over the data elements of an unpacked message, reading each
+        element once for all subsets
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param headers: BUFR headers from `get_headers`
+
+        :returns: `generator` of (element, values) tuples, element is the
+                  plan entry from `get_plan` and values is an array with one
+                  entry per subset, or a single entry if constant across
+                  subsets, converted to the preferred units
+        """
+
+        for element in self.get_plan(bufr_handle, headers):
+            values = codes_get_array(bufr_handle, element["key"])
+            if element["conversion"]:
+                values = convert_units(values, element["conversion"])
+            if element["qualifier"]:
+                element = self.get_message_attributes(bufr_handle, element)
+            yield element, values
+
+    def get_message_attributes(self, bufr_handle: int, element: dict) -> dict:
+        """
+        Adds the attributes that may differ between messages sharing a plan
+        (scale, reference value and width) to a plan entry
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param element: plan entry from `get_plan`
+
+        :returns: copy of the plan entry with the attributes of this message
+        """
+
+        attributes = dict(element["attributes"])
+        for attribute in MESSAGE_ATTRIBUTES:
+            attribute_key = f"{element['key']}->{attribute}"
+            try:
+                attribute_value = codes_get(bufr_handle, attribute_key)
+            except Exception as e:
+                LOGGER.warning(f"Error reading {attribute_key}: {e}")
+                attribute_value = None
+            if attribute_value is not None:
+                attributes[attribute] = attribute_value
+
+        return {**element, "attributes": attributes}
+
+    def get_subset_elements(self, bufr_handle: int, headers: dict) -> list:
+        """
+        Reads the data elements of a single subset message
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param headers: BUFR headers from `get_headers`
+
+        :returns: `list` of (element, value) tuples
+        """
 
-            # get class
-            xx = int(fxxyyy[1:3])
-            # get value and attributes
+        # get number of subsets
+        nsubsets = headers["numberOfSubsets"]
+        LOGGER.debug(f"nsubsets: {nsubsets}")
+        try:
+            assert nsubsets == 1
+        except Exception:
+            LOGGER.error(f"Too many subsets in call to as_geojson ({nsubsets})")  # noqa
+
+        elements = []
+        for element, values in self.get_elements(bufr_handle, headers):
             # get as array and convert to scalar if required
-            value = codes_get_array(bufr_handle, key)
-            if (len(value) == 1) and (not isinstance(value, str)):
-                value = value[0]
-                if value in (CODES_MISSING_DOUBLE, CODES_MISSING_LONG):
-                    value = None
-                # now convert to regular python types as json.dumps doesn't
-                # like numpy
-                if isinstance(value, np.float64):
-                    value = float(value)
-                elif isinstance(value, np.int64):
-                    value = int(value)
+            if (len(values) == 1) and (not isinstance(values, str)):
+                value = as_scalar(values[0])
             else:
                 assert False
+            elements.append((element, value))
 
-            # get attributes
-            attributes = {}
-            for attribute in ATTRIBUTES:
-                attribute_key = f"{key}->{attribute}"
-                try:
-                    attribute_value = codes_get(bufr_handle, attribute_key)
-                except Exception as e:
-                    LOGGER.warning(f"Error reading {attribute_key}: {e}")
-                    attribute_value = None
-                if attribute_value is not None:
-                    attributes[attribute] = attribute_value
-
-            units = attributes.get("units")
+        return elements
+
+    def as_geojson(self, bufr_handle: int, id: str,
+                   serialize: bool = False) -> dict:
+        """
+        Function to return GeoJSON representation of BUFR message
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param id: id to assign to feature collection
+        :param serialize: whether to return as JSON string (default is False)
+
+        :returns: dictionary containing GeoJSON feature collection
+        """
+
+        # check we have data
+        if not bufr_handle:
+            LOGGER.warning("Empty BUFR")
+            return {}
+
+        LOGGER.debug(f"Processing {id}")
+
+        # unpack the message
+        codes_set(bufr_handle, "unpack", True)
+
+        headers = self.get_headers(bufr_handle)
+        elements = self.get_subset_elements(bufr_handle, headers)
+
+        data = self.features(elements, headers, id)
+
+        if serialize:
+            data = json.dumps(data, indent=4)
+        return data
+
+    def as_row(self, bufr_handle: int, columns: set,
+               serialize: bool = False) -> dict:
+        """
+        Function to return a flat record of a single subset BUFR message
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param columns: names of the data elements to include
+        :param serialize: whether to return as JSON string (default is False)
+
+        :returns: dictionary containing station identification, location and
+                  the requested data elements, see `row`
+        """
+
+        # check we have data
+        if not bufr_handle:
+            LOGGER.warning("Empty BUFR")
+            return {}
+
+        # unpack the message
+        codes_set(bufr_handle, "unpack", True)
+
+        headers = self.get_headers(bufr_handle)
+        elements = self.get_subset_elements(bufr_handle, headers)
+
+        data = self.row(elements, columns)
+
+        if serialize:
+            data = json.dumps(data, indent=4)
+        return data
+
+    def as_subsets(self, bufr_handle: int, serialize: bool = False,
+                   columns: set = None) -> Iterator[dict]:
+        """
+        Function to return the representation of each subset of a compressed
+        multi-subset BUFR message. The message is unpacked once and each
+        element is read for all subsets in a single call, instead of
+        extracting and unpacking every subset separately.
+
+        :param bufr_handle: integer handle for BUFR data (used by eccodes)
+        :param serialize: whether to return as JSON string (default is False)
+        :param columns: names of the data elements to return as a flat record
+                        per subset (see `row`), GeoJSON is returned if not
+                        provided
+
+        :returns: `generator` of dictionaries, one per subset
+        """
+
+        # check we have data
+        if not bufr_handle:
+            LOGGER.warning("Empty BUFR")
+            return
+
+        # unpack the message
+        codes_set(bufr_handle, "unpack", True)
+
+        headers = self.get_headers(bufr_handle)
+
+        nsubsets = headers["numberOfSubsets"]
+        LOGGER.debug(f"as_subsets.nsubsets: {nsubsets}")
+
+        if not headers["compressedData"]:
+            msg = "Uncompressed message in call to as_subsets"
+            LOGGER.error(msg)
+            raise ValueError(msg)
+
+        elements_values = list(self.get_elements(bufr_handle, headers))
+
+        headers["numberOfSubsets"] = 1
+        for idx in range(nsubsets):
+            LOGGER.debug(f"Processing subset {idx}")
+            self.reset()
+            headers["subsetNumber"] = idx + 1
+            elements = []
+            for element, values in elements_values:
+                # values constant across all subsets are returned once
+                value = values[idx] if len(values) > 1 else values[0]
+                elements.append((element, as_scalar(value)))
+
+            # only include tag if more than 1 subset in file
+            tag = f"-{idx}" if nsubsets > 1 else ""
+            try:
+                if columns is None:
+                    data = self.features(elements, headers, tag)
+                else:
+                    data = self.row(elements, columns)
+            except Exception as e:
+                LOGGER.error("Error parsing BUFR subset, no data written")
+                LOGGER.error(e)
+                self.failed += 1
+                data = {}
+
+            if serialize:
+                data = json.dumps(data, indent=4)
+            yield data
+
+    def observations(self, elements: list) -> Iterator[tuple]:
+        """
+        Iterates over the data elements of a single subset, setting
+        qualifiers as they are encountered. Qualifiers in force when an
+        observation is returned apply to that observation.
+
+        :param elements: list of (element, value) tuples, element being the
+                         plan entry from `get_plan`
+
+        :returns: `generator` of (index, element, value, description) tuples
+                  for data elements with a value
+        """
+
+        last_key = None
+        index = 0
+
+        for element, value in elements:
+            fxxyyy = element["fxxyyy"]
+            xx = element["xx"]
+            key = element["name"]
+            attributes = element["attributes"]
+
+            units = element["units"]
             # next decoded value if from code table
             description = None
             if units == "CODE TABLE":
@@ -700,19 +1111,7 @@ class BUFRParser:
             elif units == "CCITT IA5":
                 description = value
                 value = None
-            if (units in PREFERRED_UNITS) and (value is not None):
-                value = Units.conform(value, Units(units),
-                                      Units(PREFERRED_UNITS[units]))
-                # round to 6 d.p. to remove any erroneous digits
-                # due to IEEE arithmetic
-                value = round(value, 6)
-                units = PREFERRED_UNITS[units]
-                attributes["units"] = units
             # now process
-            # first process key to something more sensible
-            key = re.sub("#[0-9]+#", "", key)
-            key = re.sub("([a-z])([A-Z])", r"\1_\2", key)
-            key = key.lower()
             append = False
             if xx < 9:
                 if ((xx >= 4) and (xx < 8)) and (key == last_key):
@@ -728,150 +1127,446 @@ class BUFRParser:
                                        attributes, append)
                     continue
                 if value is not None:
-                    self.get_identification()
-                    metadata = self.get_qualifiers()
-                    metadata_hash = hashlib.md5(json.dumps(metadata).encode("utf-8")).hexdigest()  # noqa
-                    md = {
-                        "id": metadata_hash,
-                        "metadata": list()
-                    }
-                    for idx in range(len(metadata)):
-                        md["metadata"].append(metadata[idx])
-                    wsi = self.get_wsi()
-                    feature_id = f"WIGOS_{wsi}_{characteristic_date}T{characteristic_time}"  # noqa
-                    feature_id = f"{feature_id}{id}-{index}"
-                    phenomenon_time = self.get_time()
-                    if "/" in phenomenon_time:
-                        result_time = phenomenon_time.split("/")
-                        result_time = result_time[1]
-                    else:
-                        result_time = phenomenon_time
-                    data[feature_id] = {
-                        "geojson": {
-                            "id": feature_id,
-                            "conformsTo": ["http://www.wmo.int/spec/om-profile-1/1.0/req/geojson"],  # noqa
-                            "reportId": f"WIGOS_{wsi}_{characteristic_date}T{characteristic_time}{id}",  # noqa
-                            "type": "Feature",
-                            "geometry": self.get_location(),
-                            "properties": {
-                                # "identifier": feature_id,
-                                "wigos_station_identifier": wsi,
-                                "phenomenonTime": phenomenon_time,
-                                "resultTime": result_time,
-                                "name": key,
-                                "value": value,
-                                "units": attributes.get("units"),
-                                "description": description,
-                                "metadata": metadata,
-                                "index": index,
-                                "fxxyyy": fxxyyy
-                            }
-                        },
-                        "_meta": {
-                            "data_date": self.get_time(),
-                            "identifier": feature_id,
-                            "geometry": self.get_location(),
-                            "metadata_hash": metadata_hash
-                        },
-                        "_headers": deepcopy(headers)
-                    }
-                else:
-                    pass
+                    yield index, element, value, description
             last_key = key
             index += 1
-        codes_bufr_keys_iterator_delete(key_iterator)
-        if serialize:
-            data = json.dumps(data, indent=4)
+
+    def features(self, elements: list, headers: dict, id: str) -> dict:
+        """
+        Function to build the GeoJSON features for the data elements of a
+        single subset
+
+        :param elements: list of (element, value) tuples, element being the
+                         plan entry from `get_plan`
+        :param headers: BUFR headers from `get_headers`
+        :param id: id to assign to feature collection
+
+        :returns: dictionary containing GeoJSON feature collection
+        """
+
+        characteristic_date = headers["typicalDate"]
+        characteristic_time = headers["typicalTime"]
+
+        # set up data structures
+        data = {}
+
+        # iterate over observations and add to dict
+        for index, element, value, description in self.observations(elements):  # noqa
+            fxxyyy = element["fxxyyy"]
+            key = element["name"]
+            attributes = element["attributes"]
+
+            self.get_identification()
+            metadata = self.get_qualifiers()
+            metadata_hash = hashlib.md5(json.dumps(metadata).encode("utf-8")).hexdigest()  # noqa
+            md = {
+                "id": metadata_hash,
+                "metadata": list()
+            }
+            for idx in range(len(metadata)):
+                md["metadata"].append(metadata[idx])
+            wsi = self.get_wsi()
+            feature_id = f"WIGOS_{wsi}_{characteristic_date}T{characteristic_time}"  # noqa
+            feature_id = f"{feature_id}{id}-{index}"
+            phenomenon_time = self.get_time()
+            if "/" in phenomenon_time:
+                result_time = phenomenon_time.split("/")
+                result_time = result_time[1]
+            else:
+                result_time = phenomenon_time
+            data[feature_id] = {
+                "geojson": {
+                    "id": feature_id,
+                    "conformsTo": ["http://www.wmo.int/spec/om-profile-1/1.0/req/geojson"],  # noqa
+                    "reportId": f"WIGOS_{wsi}_{characteristic_date}T{characteristic_time}{id}",  # noqa
+                    "type": "Feature",
+                    "geometry": self.get_location(),
+                    "properties": {
+                        # "identifier": feature_id,
+                        "wigos_station_identifier": wsi,
+                        "phenomenonTime": phenomenon_time,
+                        "resultTime": result_time,
+                        "name": key,
+                        "value": value,
+                        "units": attributes.get("units"),
+                        "description": description,
+                        "metadata": metadata,
+                        "index": index,
+                        "fxxyyy": fxxyyy
+                    }
+                },
+                "_meta": {
+                    "data_date": self.get_time(),
+                    "identifier": feature_id,
+                    "geometry": self.get_location(),
+                    "metadata_hash": metadata_hash
+                },
+                "_headers": deepcopy(headers)
+            }
+        return data
+
+    def row(self, elements: list, columns: set) -> dict:
+        """
+        Function to build a flat record for a single subset, holding the
+        station identification and location in force at the first
+        observation and the last value of each requested data element
+
+        :param elements: list of (element, value) tuples, element being the
+                         plan entry from `get_plan`
+        :param columns: names of the data elements to include
+
+        :returns: dictionary with `wigos_id`, `station_or_site_name`,
+                  `longitude`, `latitude`, `elevation` and data element keys,
+                  empty if the subset has no observations
+        """
+
+        data = {}
+
+        for index, element, value, description in self.observations(elements):  # noqa
+            if not data:
+                location = self.get_location() or {"coordinates": [None, None]}  # noqa
+                coordinates = location["coordinates"]
+                data = {
+                    "wigos_id": self.get_wsi(),
+                    "station_or_site_name": strip2(self.get_qualifier("01", "station_or_site_name")),  # noqa
+                    "longitude": coordinates[0],
+                    "latitude": coordinates[1],
+                    "elevation": coordinates[2] if len(coordinates) > 2 else None  # noqa
+                }
+            if element["name"] in columns:
+                data[element["name"]] = value
+
         return data
 
 
-def transform(data: bytes, serialize: bool = False) -> Iterator[dict]:
+def get_conversion(from_units: str, to_units: str) -> tuple:
     """
-    Main transformation
+    Gets the affine coefficients to convert values between two units
 
-    :param data: byte string of BUFR data
-    :param serialize: whether to return as JSON string (default is False)
+    :param from_units: units to convert from
+    :param to_units: units to convert to
 
-    :returns: `generator` of GeoJSON features
+    :returns: (scale, offset) tuple, converted = value * scale + offset
     """
 
-    error = False
+    pair = (from_units, to_units)
+    if pair not in UNIT_CONVERSIONS:
+        reference = Units.conform(np.array([0.0, 1.0]), Units(from_units),
+                                  Units(to_units))
+        UNIT_CONVERSIONS[pair] = (float(reference[1] - reference[0]),
+                                  float(reference[0]))
+
+    return UNIT_CONVERSIONS[pair]
+
+
+def convert_units(values: np.ndarray, conversion: tuple) -> np.ndarray:
+    """
+    Converts an array of values using the coefficients from `get_conversion`,
+    ecCodes missing values are left as they are
+
+    :param values: array of values as returned by ecCodes
+    :param conversion: (scale, offset) tuple
+
+    :returns: array of converted values
+    """
 
-    # FIXME: figure out how to pass a bytestring to ecCodes BUFR reader
-    tmp = tempfile.NamedTemporaryFile()
-    with open(tmp.name, 'wb') as f:
-        f.write(data)
+    scale, offset = conversion
+    values = np.asarray(values, dtype=np.float64)
+    missing = (values == CODES_MISSING_DOUBLE) | (values == CODES_MISSING_LONG)
+    # round to 6 d.p. to remove any erroneous digits due to IEEE arithmetic
+    converted = np.round(values * scale + offset, 6)
+
+    return np.where(missing, values, converted)
+
+
+def as_scalar(value) -> Union[float, int, complex, str, None]:
+    """
+    Convert a value read from ecCodes to a regular python type, mapping the
+    ecCodes missing values to None
+
+    :param value: value as returned by ecCodes
+
+    :returns: python scalar or None
+    """
+
+    if isinstance(value, str):
+        return value
+    if value in (CODES_MISSING_DOUBLE, CODES_MISSING_LONG):
+        return None
+    # now convert to regular python types as json.dumps doesn't
+    # like numpy
+    if isinstance(value, np.floating):
+        return float(value)
+    elif isinstance(value, np.integer):
+        return int(value)
+    return value
+
+
+def index_messages(data: Union[bytes, mmap.mmap]) -> list:
+    """
+    Index the BUFR messages held in a buffer in a single pass
+
+    Messages are located by their "BUFR" start marker and the total length
+    encoded in section 0, anything in between (e.g. GTS headers) is skipped.
+
+    :param data: byte string or memory map of BUFR data
+
+    :returns: `list` of (offset, length) tuples, one per BUFR message
+    """
+
+    index = []
+    offset = data.find(b"BUFR")
+    while offset != -1:
+        length = int.from_bytes(data[offset + 4:offset + 7], "big")
+        end = offset + length
+        if length < 8 or data[end - 4:end] != b"7777":
+            LOGGER.warning(f"Invalid BUFR message at offset {offset}, skipping")  # noqa
+            offset = data.find(b"BUFR", offset + 4)
+            continue
+        index.append((offset, length))
+        offset = data.find(b"BUFR", end)
+
+    return index
+
+
+def iter_messages(data: Union[bytes, mmap.mmap],
+                  index: list = None) -> Iterator[bytes]:
+    """
+    Split a buffer holding one or more BUFR messages into its messages
+
+    :param data: byte string or memory map of BUFR data
+    :param index: (offset, length) tuples from `index_messages`, computed
+                  if not provided
+
+    :returns: `generator` of byte strings, one per BUFR message
+    """
+
+    if index is None:
+        index = index_messages(data)
+
+    for offset, length in index:
+        yield data[offset:offset + length]
+
+
+def upgrade_edition(bufr_handle: int) -> int:
+    """
+    Re-encode a BUFR message as edition 4 if required. The parser relies on
+    edition 4 header keys (e.g. typicalSecond) so older editions are
+    converted in process, equivalent to `bufr_set -s edition=4`.
+
+    :param bufr_handle: integer handle for BUFR data (used by eccodes)
+
+    :returns: handle to an edition 4 message, the input handle is released
+              once a new message has been created
+    """
+
+    edition = codes_get(bufr_handle, "edition")
+    if edition >= 4:
+        return bufr_handle
+
+    LOGGER.debug(f"Converting BUFR edition {edition} message to edition 4")
+    codes_set(bufr_handle, "edition", 4)
+    message = codes_get_message(bufr_handle)
+    # the input handle is left live if the new message can not be created
+    new_handle = codes_new_from_message(message)
+    codes_release(bufr_handle)
+
+    return new_handle
+
+
+def transform_messages(messages: Iterator[bytes], serialize: bool = False,
+                       vectorize: bool = True,
+                       columns: set = None) -> Iterator[dict]:
+    """
+    Transform BUFR messages held in memory
+
+    :param messages: iterable of byte strings, one per BUFR message
+    :param serialize: whether to return as JSON string (default is False)
+    :param vectorize: whether to decode compressed multi-subset messages in
+                      a single pass rather than subset by subset
+                      (default is True)
+    :param columns: names of data elements to return as one flat record per
+                    subset instead of GeoJSON features (default is None,
+                    return GeoJSON)
+
+    :returns: `generator` of GeoJSON features or records
+    """
 
     # check data type, only in situ supported
     # not yet implemented
     # split subsets into individual messages and process
     imsg = 0
     failed = 0
-    messages_remaining = True
-    with open(tmp.name, 'rb') as fh:
-        # get first message
-        bufr_handle = codes_bufr_new_from_file(fh)
-        if bufr_handle is None:
-            LOGGER.warning("No messages in file")
-            messages_remaining = False
-        while messages_remaining:
-            messages_remaining = False  # noqa set to false to prevent infinite loop by accident
-            imsg += 1
-            LOGGER.info(f"Processing message {imsg} from file")
+    for message in messages:
+        imsg += 1
+        LOGGER.info(f"Processing message {imsg} from file")
 
-            try:
+        bufr_handle = None
+
+        try:
+            bufr_handle = codes_new_from_message(message)
+            bufr_handle = upgrade_edition(bufr_handle)
+            nsubsets = codes_get(bufr_handle, "numberOfSubsets")
+            compressed = codes_get(bufr_handle, "compressedData")
+            # compressed messages are unpacked once by as_subsets
+            if not (vectorize and compressed and nsubsets > 1):
                 codes_set(bufr_handle, "unpack", True)
+        except Exception as e:
+            LOGGER.error("Error unpacking message")
+            LOGGER.error(e)
+            if bufr_handle is not None:
+                codes_release(bufr_handle)
+            yield {}
+            continue
+
+        LOGGER.info(f"{nsubsets} subsets")
+
+        if vectorize and compressed and nsubsets > 1:
+            parser = BUFRParser()
+            try:
+                for data in parser.as_subsets(bufr_handle,
+                                              serialize=serialize,
+                                              columns=columns):
+                    yield data
             except Exception as e:
-                LOGGER.error("Error unpacking message")
+                LOGGER.error("Error parsing BUFR message, no data written")
                 LOGGER.error(e)
-                error = True
-
-            if not error:
-                nsubsets = codes_get(bufr_handle, "numberOfSubsets")
-                LOGGER.info(f"{nsubsets} subsets")
-                collections = dict()
-                for idx in range(nsubsets):
-                    LOGGER.debug(f"Extracting subset {idx}")
-                    codes_set(bufr_handle, "extractSubset", idx + 1)
-                    codes_set(bufr_handle, "doExtractSubsets", 1)
-                    LOGGER.debug("Cloning subset to new message")
-                    single_subset = codes_clone(bufr_handle)
-                    LOGGER.debug("Unpacking")
-                    codes_set(single_subset, "unpack", True)
-
-                    parser = BUFRParser()
-                    # only include tag if more than 1 subset in file
-                    tag = ""
-                    if nsubsets > 1:
-                        tag = f"-{idx}"
-                    try:
-                        data = parser.as_geojson(single_subset, id=tag,
-                                                 serialize=serialize)
+                failed += 1
+            failed += parser.failed
+            del parser
+            codes_release(bufr_handle)
+            continue
+
+        for idx in range(nsubsets):
+            LOGGER.debug(f"Extracting subset {idx}")
+            codes_set(bufr_handle, "extractSubset", idx + 1)
+            codes_set(bufr_handle, "doExtractSubsets", 1)
+            LOGGER.debug("Cloning subset to new message")
+            single_subset = codes_clone(bufr_handle)
+            LOGGER.debug("Unpacking")
+            codes_set(single_subset, "unpack", True)
+
+            parser = BUFRParser()
+            # only include tag if more than 1 subset in file
+            tag = ""
+            if nsubsets > 1:
+                tag = f"-{idx}"
+            try:
+                if columns is None:
+                    data = parser.as_geojson(single_subset, id=tag,
+                                             serialize=serialize)
+                else:
+                    data = parser.as_row(single_subset, columns,
+                                         serialize=serialize)
 
-                    except Exception as e:
-                        LOGGER.error("Error parsing BUFR to GeoJSON, no data written")  # noqa
-                        LOGGER.error(e)
-                        failed += 1
-                        data = {}
-                    del parser
-                    collections = deepcopy(data)
-
-                    yield collections
-                    codes_release(single_subset)
-            else:
-                collections = {}
-                yield collections
+            except Exception as e:
+                LOGGER.error("Error parsing BUFR to GeoJSON, no data written")  # noqa
+                LOGGER.error(e)
+                failed += 1
+                data = {}
+            del parser
+            codes_release(single_subset)
 
-            if not error:
-                codes_release(bufr_handle)
+            yield data
 
-            bufr_handle = codes_bufr_new_from_file(fh)
+        codes_release(bufr_handle)
 
-            if bufr_handle is not None:
-                messages_remaining = True
+    if imsg == 0:
+        LOGGER.warning("No messages in file")
+
+    LOGGER.info(f"{imsg} messages processed from file")
+    LOGGER.info(f"Failed geojson messages: {failed}")
+
+
+def transform(data: bytes, serialize: bool = False, vectorize: bool = True,
+              columns: set = None) -> Iterator[dict]:
+    """
+    Main transformation
+
+    :param data: byte string of BUFR data
+    :param serialize: whether to return as JSON string (default is False)
+    :param vectorize: whether to decode compressed multi-subset messages in
+                      a single pass (default is True)
+    :param columns: names of data elements to return as one flat record per
+                    subset instead of GeoJSON features (default is None)
+
+    :returns: `generator` of GeoJSON features or records
+    """
+
+    yield from transform_messages(iter_messages(data), serialize=serialize,
+                                  vectorize=vectorize, columns=columns)
+
+
+def _transform_file_range(path: Union[str, Path], index: list,
+                          serialize: bool = False, vectorize: bool = True,
+                          columns: set = None) -> list:
+    """
+    Transform a range of messages from a BUFR file, used by pool workers
+
+    :param path: path to BUFR file
+    :param index: (offset, length) tuples of the messages to transform
+    :param serialize: whether to return as JSON string (default is False)
+    :param vectorize: whether to decode compressed multi-subset messages in
+                      a single pass (default is True)
+    :param columns: names of data elements to return as one flat record per
+                    subset instead of GeoJSON features (default is None)
+
+    :returns: `list` of GeoJSON features or records
+    """
 
-        LOGGER.info(f"{imsg} messages processed from file")
-        LOGGER.info(f"Failed geojson messages: {failed}")
+    with open(path, "rb") as fh:
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return list(transform_messages(iter_messages(mm, index),
+                                           serialize=serialize,
+                                           vectorize=vectorize,
+                                           columns=columns))
+
+
+def transform_file(path: Union[str, Path], serialize: bool = False,
+                   workers: int = 1, vectorize: bool = True,
+                   columns: set = None) -> Iterator[dict]:
+    """
+    Transform a BUFR file, decoding its messages in place through `mmap`
+
+    :param path: path to BUFR file
+    :param serialize: whether to return as JSON string (default is False)
+    :param workers: number of processes to decode with, messages are split
+                    into contiguous ranges and results are returned in file
+                    order (default is 1, decode serially)
+    :param vectorize: whether to decode compressed multi-subset messages in
+                      a single pass (default is True)
+    :param columns: names of data elements to return as one flat record per
+                    subset instead of GeoJSON features (default is None)
+
+    :returns: `generator` of GeoJSON features or records
+    """
+
+    with open(path, "rb") as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            LOGGER.warning("No messages in file")
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            index = index_messages(mm)
+
+            if workers is None or workers < 2 or len(index) < 2:
+                yield from transform_messages(iter_messages(mm, index),
+                                              serialize=serialize,
+                                              vectorize=vectorize,
+                                              columns=columns)
+                return
+
+    # several ranges per worker to even out the load across processes
+    nranges = min(len(index), workers * 4)
+    size = -(-len(index) // nranges)
+    ranges = [index[i:i + size] for i in range(0, len(index), size)]
+    LOGGER.info(f"Decoding {len(index)} messages in {len(ranges)} ranges using {workers} processes")  # noqa
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_transform_file_range, repeat(path), ranges,
+                               repeat(serialize), repeat(vectorize),
+                               repeat(columns))
+        for result in results:
+            yield from result
 
 
 def strip2(value) -> str:
@@ -26,7 +26,7 @@ import sys
 
 import click
 
-from synop.bufr2geojson import __version__, transform as as_geojson
+from synop.bufr2geojson import __version__, transform_file as as_geojson
 
 
 def cli_option_verbosity(f):
@@ -64,13 +64,15 @@ def data():
 
 @click.command()
 @click.pass_context
-@click.argument("bufr_file", type=click.File(mode="rb", errors="ignore"))
+@click.argument("bufr_file", type=click.Path(exists=True, dir_okay=False))
 @click.option("--output-dir", "output_dir", required=True,
               help="Name of output file")
+@click.option("--workers", "workers", type=int, default=1,
+              help="Number of decoding processes")
 @cli_option_verbosity
-def transform(ctx, bufr_file, output_dir, verbosity):
-    click.echo(f"Transforming {bufr_file.name} to geojson")
-    result = as_geojson(bufr_file.read())
+def transform(ctx, bufr_file, output_dir, workers, verbosity):
+    click.echo(f"Transforming {bufr_file} to geojson")
+    result = as_geojson(bufr_file, workers=workers)
     for collection in result:
         for key, item in collection.items():
             outfile = f"{output_dir}{os.sep}{key}.json"
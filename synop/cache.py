@@ -0,0 +1,202 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+
+from synop.config import SETTINGS
+from synop.utils import atomic_write
+
+STATE_DIR = SETTINGS.get("STATE_DIR")
+TILE_CACHE_DIR = SETTINGS.get("TILE_CACHE_DIR") or os.path.join(STATE_DIR or "/tmp", "tiles")
+TILE_CACHE_SIZE = SETTINGS.get("TILE_CACHE_SIZE")
+TILE_CACHE_MAX_ZOOM = SETTINGS.get("TILE_CACHE_MAX_ZOOM")
+TILE_CACHE_DISK_SIZE = SETTINGS.get("TILE_CACHE_DISK_SIZE")
+
+# disk writes between two size checks, per process
+PRUNE_INTERVAL = 500
+
+
+class TileCache(object):
+    """Vector tiles cached in memory and on disk, invalidated per date.
+
+    Each date has a stamp file holding a random token. Tiles are stored under the
+    current token, so rewriting the stamp invalidates the tiles of that date in every
+    process sharing the cache directory, including their in-memory copies.
+
+    Only tiles up to max_zoom are written to disk, and the oldest files are removed once
+    the directory grows past disk_size bytes.
+    """
+
+    def __init__(self, cache_dir, size, max_zoom, disk_size):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.max_zoom = max_zoom
+        self.disk_size = disk_size
+        self.tiles = OrderedDict()
+        self.lock = threading.Lock()
+        self.writes = 0
+
+    @staticmethod
+    def date_key(date):
+        return date.strftime("%Y%m%d%H%M")
+
+    @staticmethod
+    def parameters_key(parameters):
+        if not parameters:
+            return "all"
+
+        return hashlib.sha1(",".join(sorted(parameters)).encode()).hexdigest()[:16]
+
+    def stamp_path(self, date):
+        return os.path.join(self.cache_dir, f"{self.date_key(date)}.stamp")
+
+    def get_stamp(self, date):
+        stamp_file = self.stamp_path(date)
+
+        try:
+            with open(stamp_file, "r") as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return self.new_stamp(date)
+
+    def new_stamp(self, date):
+        stamp = uuid.uuid4().hex
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        atomic_write(stamp, self.stamp_path(date))
+
+        return stamp
+
+    def tile_path(self, date, stamp, z, x, y, parameters):
+        return os.path.join(self.cache_dir, self.date_key(date), stamp, str(z), str(x),
+                            f"{y}-{self.parameters_key(parameters)}.pbf")
+
+    def get(self, date, z, x, y, parameters, render):
+        stamp = self.get_stamp(date)
+        key = (self.date_key(date), stamp, z, x, y, self.parameters_key(parameters))
+
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+
+        tile_file = self.tile_path(date, stamp, z, x, y, parameters)
+
+        if z <= self.max_zoom and os.path.exists(tile_file):
+            with open(tile_file, "rb") as f:
+                tile = f.read()
+        else:
+            tile = render(date, z, x, y, parameters)
+
+            if z <= self.max_zoom:
+                self.write(tile_file, tile)
+
+        with self.lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+
+            while len(self.tiles) > self.size:
+                self.tiles.popitem(last=False)
+
+        return tile
+
+    def write(self, tile_file, tile):
+        try:
+            os.makedirs(os.path.dirname(tile_file), exist_ok=True)
+            atomic_write(tile, tile_file, mode="wb")
+        except OSError as e:
+            logging.warning(f"[TILES]: Error caching tile {tile_file}: {e}")
+
+        with self.lock:
+            self.writes += 1
+            prune = self.writes % PRUNE_INTERVAL == 0
+
+        if prune:
+            self.prune()
+
+    def prune(self):
+        files = []
+        total = 0
+
+        for root, _, names in os.walk(self.cache_dir):
+            for name in names:
+                if not name.endswith(".pbf"):
+                    continue
+
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+
+                files.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        if total <= self.disk_size:
+            return
+
+        # remove the oldest tiles until well under the limit
+        removed = 0
+        for _, size, path in sorted(files):
+            if total <= self.disk_size * 0.9:
+                break
+
+            try:
+                os.unlink(path)
+                total -= size
+                removed += 1
+            except FileNotFoundError:
+                pass
+
+        logging.info(f"[TILES]: Pruned {removed} tiles from the disk cache")
+
+    def invalidate_all(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".stamp"):
+                self.invalidate(datetime.strptime(name[:-len(".stamp")], "%Y%m%d%H%M"), prune=False)
+
+        self.prune()
+
+    def invalidate(self, date, prune=True):
+        date_key = self.date_key(date)
+        stamp = self.new_stamp(date)
+
+        with self.lock:
+            for key in [key for key in self.tiles if key[0] == date_key]:
+                del self.tiles[key]
+
+        # remove the tiles of previous stamps, including any written while invalidating
+        date_dir = os.path.join(self.cache_dir, date_key)
+        if os.path.isdir(date_dir):
+            for name in os.listdir(date_dir):
+                if name != stamp:
+                    shutil.rmtree(os.path.join(date_dir, name), ignore_errors=True)
+
+        logging.info(f"[TILES]: Invalidated tiles for date {date.isoformat()}")
+
+        if prune:
+            self.prune()
+
+    def seed(self, date, render, max_zoom):
+        count = 0
+
+        for z in range(max_zoom + 1):
+            for x in range(2 ** z):
+                for y in range(2 ** z):
+                    self.get(date, z, x, y, None, render)
+                    count += 1
+
+        logging.info(f"[TILES]: Seeded {count} tiles for date {date.isoformat()}")
+
+        return count
+
+
+tile_cache = TileCache(TILE_CACHE_DIR, TILE_CACHE_SIZE, TILE_CACHE_MAX_ZOOM, TILE_CACHE_DISK_SIZE)
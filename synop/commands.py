@@ -1,25 +1,48 @@
 import datetime
 import logging
 import os
-import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 
 import click
-from pyoscar import OSCARClient
 from sqlalchemy.sql import text
 
 from synop import db
+from synop.cache import tile_cache
+from synop.bufr2geojson import CODETABLE_INDEX_DIR, compile_codetables as compile_codetable_index
 from synop.config import SETTINGS
 from synop.constants import COUNTRIES
-from synop.models import Station, StationIdentifier
 from synop.utils import (
-    read_state,
     get_next_available_timestep,
-    convert_bufr3, update_state,
-    bufr2geojson,
-    load_obs_from_geojson
+    get_timestep_file_name,
+    list_timestep_files,
+    watch_timestep_files,
+    TIMESTEP_FILE_PATTERN,
+    get_ingested_timesteps,
+    get_last_ingested_timestep,
+    claim_file,
+    complete_file,
+    fail_file,
+    decode_timestep,
+    load_station_map,
+    load_obs_from_rows,
+    get_oscar_stations,
+    parse_oscar_stations,
+    upsert_stations,
+    upsert_station_identifiers,
+    bump_generation,
+    get_station_territories,
+    refresh_station_statistics,
+    get_observation_tile
 )
 
 DATASETS_DIR = SETTINGS.get("DATASETS_DIR")
+INGEST_WORKERS = SETTINGS.get("INGEST_WORKERS")
+INGEST_POLL_INTERVAL = SETTINGS.get("INGEST_POLL_INTERVAL")
+STATION_MAP_TTL = SETTINGS.get("STATION_MAP_TTL")
+OSCAR_WORKERS = SETTINGS.get("OSCAR_WORKERS")
+TILE_SEED_MAX_ZOOM = SETTINGS.get("TILE_SEED_MAX_ZOOM")
 
 
 @click.command(name="setup_schema")
@@ -48,23 +71,35 @@ def create_pg_function():
             z integer,
             x integer,
             y integer,
-            date timestamp without time zone)
+            date timestamp without time zone,
+            parameters text[])
             RETURNS bytea
             LANGUAGE 'plpgsql'
             COST 100
-            STABLE STRICT PARALLEL SAFE 
+            STABLE PARALLEL SAFE 
         AS $BODY$
         DECLARE
             result bytea;
         BEGIN
             WITH
             bounds AS (
-                -- Convert tile coordinates to web mercator tile bounds
-                SELECT ST_TileEnvelope(z, x, y) AS geom
+                -- Convert tile coordinates to web mercator tile bounds, and to the
+                -- station srid so the geom index can be used
+                SELECT ST_TileEnvelope(z, x, y) AS geom,
+                       ST_Transform(ST_TileEnvelope(z, x, y), 4326) AS geom_4326
             ),
             mvt AS (
-                SELECT ST_AsMVTGeom(ST_Transform(s.geom, 3857), bounds.geom) AS geom, s.name, o.* FROM public.synop_observation o, bounds, public.synop_station s
-            WHERE o.time = date and o.wigos_id=s.wigos_id
+                SELECT ST_AsMVTGeom(ST_Transform(s.geom, 3857), bounds.geom) AS geom, s.name, o.wigos_id, o.time,
+                    -- all parameters when none are requested, otherwise only the requested ones
+                    CASE WHEN parameters IS NULL THEN to_jsonb(o) - 'id' - 'wigos_id' - 'time'
+                    ELSE (
+                        SELECT coalesce(jsonb_object_agg(p.key, p.value), '{{}}'::jsonb)
+                        FROM jsonb_each(to_jsonb(o)) p
+                        WHERE p.key = ANY(parameters)
+                    ) END AS properties
+                FROM bounds, public.synop_station s
+                JOIN public.synop_observation o ON o.wigos_id = s.wigos_id
+                WHERE o.time = date AND ST_Intersects(s.geom, bounds.geom_4326)
             )
             -- Generate MVT encoding of final input record
             SELECT ST_AsMVT(mvt, 'default')
@@ -73,7 +108,20 @@ def create_pg_function():
         
             RETURN result;
         END;
-        $BODY$;    
+        $BODY$;
+
+            -- keep the original signature for existing tile server layers
+            CREATE OR REPLACE FUNCTION public.synop_obs(
+            z integer,
+            x integer,
+            y integer,
+            date timestamp without time zone)
+            RETURNS bytea
+            LANGUAGE 'sql'
+            STABLE STRICT PARALLEL SAFE
+        AS $BODY$
+            SELECT public.synop_obs(z, x, y, date, NULL::text[]);
+        $BODY$;
     """
 
     db.session.execute(text(sql))
@@ -82,100 +130,201 @@ def create_pg_function():
     logging.info("[DBSETUP]: Done Creating pg function")
 
 
+@click.command(name="compile_codetables")
+@click.option("--force", is_flag=True, help="Recompile even if an index already exists")
+def compile_codetables(force):
+    if os.path.exists(os.path.join(CODETABLE_INDEX_DIR, "versions.npy")) and not force:
+        logging.info(f"[CODETABLES]: Index already exists at {CODETABLE_INDEX_DIR}. Skipping...")
+        return
+
+    logging.info(f"[CODETABLES]: Compiling code tables to {CODETABLE_INDEX_DIR}")
+
+    count = compile_codetable_index(CODETABLE_INDEX_DIR)
+
+    logging.info(f"[CODETABLES]: Done compiling {count} code table entries")
+
+
 @click.command(name="load_stations")
-def load_stations():
+@click.option("--workers", type=int, default=OSCAR_WORKERS, help="Number of countries to fetch concurrently")
+def load_stations(workers):
     logging.info("[STATIONS_LOADING]: Loading stations")
 
-    client = OSCARClient()
+    stations = {}
+    identifiers = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(get_oscar_stations, country.get("iso")): country.get("iso") for country in COUNTRIES}
+
+        for future in as_completed(futures):
+            country_iso = futures[future]
+
+            try:
+                country_stations, country_identifiers = parse_oscar_stations(future.result())
+            except Exception as e:
+                logging.error(f"[STATIONS_LOADING]: Error loading stations for country {country_iso}: {e}")
+                continue
+
+            logging.info(f"[STATIONS_LOADING]: Loaded {len(country_stations)} stations for country {country_iso}")
+            stations.update(country_stations)
+            identifiers.update(country_identifiers)
+
+    try:
+        territories = get_station_territories()
+
+        changed_stations = upsert_stations(list(stations.values()))
+        logging.info(f"[STATION]: {changed_stations} of {len(stations)} stations added or updated")
+
+        changed = upsert_station_identifiers(list(identifiers.values()))
+        logging.info(f"[STATION ID]: {changed} of {len(identifiers)} identifiers added or updated")
+
+        # rollups are per territory, recompute those the moved stations contributed to
+        moved = [wigos_id for wigos_id, station in stations.items()
+                 if wigos_id in territories and (territories[wigos_id] or '') != (station.get("territory") or '')]
+        if moved:
+            count = refresh_station_statistics(moved)
+            logging.info(f"[STATION]: {len(moved)} stations changed territory, refreshed statistics of {count} timesteps")
+
+        bump_generation("stations")
+
+        db.session.commit()
+    except Exception as e:
+        logging.error(e)
+        db.session.rollback()
+        return
+
+    if not changed_stations:
+        return
+
+    # tiles embed station names and positions
+    try:
+        tile_cache.invalidate_all()
+    except Exception as e:
+        logging.error(f"[TILES]: Error invalidating tiles: {e}")
+
+
+def refresh_tiles(timestep):
+    try:
+        tile_cache.invalidate(timestep)
+
+        # warm the low zoom levels of the newest timestep, the first one viewers open
+        if timestep == get_last_ingested_timestep():
+            tile_cache.seed(timestep, get_observation_tile, TILE_SEED_MAX_ZOOM)
 
-    for country in COUNTRIES:
-        country_iso = country.get("iso")
+        # end the read transaction, an idle one keeps its locks on synop_observation
+        db.session.commit()
+    except Exception as e:
+        logging.error(f"[TILES]: Error refreshing tiles for date '{timestep.isoformat()}': {e}")
+        db.session.rollback()
 
-        try:
-            logging.info(f"[STATIONS_LOADING]: Loading stations for country {country_iso}")
 
-            stations = client.get_stations(country=country_iso)
-            results = stations.get("stationSearchResults")
+def ingest_rows(ledger_id, timestep, rows, decode_duration, station_map=None):
+    timestep_str = timestep.isoformat()
 
-            for station in results:
-                wigos_id = station.get("wigosId")
-                longitude = station.get("longitude")
-                latitude = station.get("latitude")
+    logging.info(f"[OBS]: Ingesting {len(rows)} stations for date '{timestep_str}'...")
+    start = time.monotonic()
+    # load observation to database
+    loaded, failed = load_obs_from_rows(rows, station_map)
 
-                wigos_station_identifiers = station.get("wigosStationIdentifiers")
+    complete_file(ledger_id, len(rows), loaded, len(failed), decode_duration, time.monotonic() - start)
 
-                if not wigos_id and wigos_station_identifiers:
-                    wigos_id = wigos_station_identifiers[0].get("wigosStationIdentifier")
+    refresh_tiles(timestep)
 
-                if not wigos_id and not longitude and latitude:
+    logging.info(f"[OBS]: Done ingesting for date '{timestep_str}'...")
+
+
+def ingest_file(timestep, file_path, station_map=None):
+    f_name = os.path.basename(file_path)
+
+    ledger_id = claim_file(file_path, timestep)
+
+    if not ledger_id:
+        logging.info(f"[OBS]: '{f_name}' already ingested or being ingested. Skipping...")
+        return
+
+    try:
+        logging.info(f"[OBS]: Decoding '{f_name}'...")
+        rows, decode_duration = decode_timestep(file_path, timestep.isoformat())
+
+        ingest_rows(ledger_id, timestep, rows, decode_duration, station_map)
+    except Exception as e:
+        logging.error(f"[OBS]: Error ingesting '{f_name}': {e}")
+        db.session.rollback()
+        fail_file(ledger_id, e)
+
+
+def catch_up_observations(workers):
+    last_update = get_last_ingested_timestep()
+
+    files = list_timestep_files(DATASETS_DIR)
+
+    if not files:
+        logging.warning(f'[OBS]: No data found in {DATASETS_DIR}. Skipping...')
+        return
+
+    # timesteps newer than the last ingested, or behind it but missing from the ledger
+    ingested = get_ingested_timesteps(files[0][0], files[-1][0])
+    pending = [(timestep, file_path) for timestep, file_path in files
+               if (last_update is None or timestep > last_update) or timestep not in ingested]
+
+    if not pending:
+        logging.info('[OBS]: No timesteps to catch up')
+        return
+
+    logging.info(f'[OBS]: Catching up {len(pending)} timesteps using {workers} workers...')
+
+    station_map = load_station_map()
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = deque()
+        pending = iter(pending)
+
+        def submit():
+            for timestep, file_path in pending:
+                ledger_id = claim_file(file_path, timestep)
+
+                if not ledger_id:
+                    logging.info(f"[OBS]: '{os.path.basename(file_path)}' already ingested or being ingested. Skipping...")
                     continue
 
-                station_data = {
-                    "wigos_id": wigos_id,
-                    "name": station.get("name"),
-                    "territory": station.get("territory"),
-                    "elevation": station.get("elevation"),
-                    "longitude": station.get("longitude"),
-                    "latitude": station.get("latitude"),
-                }
-
-                db_station = Station.query.get(station_data.get("wigos_id"))
-                exists = False
-
-                if db_station:
-                    exists = True
-                else:
-                    db_station = Station(**station_data)
-
-                if exists:
-                    logging.info('[STATION]: UPDATE')
-                    db.session.merge(db_station)
-                else:
-                    logging.info('[STATION]: ADD')
-                    db.session.add(db_station)
-
-                db.session.commit()
-
-                if wigos_station_identifiers:
-                    for identifier in wigos_station_identifiers:
-                        if not identifier.get("primary"):
-                            station_identifier = identifier.get("wigosStationIdentifier")
-                            station_id_data = {
-                                "wigos_id": wigos_id,
-                                "identifier": station_identifier
-                            }
-
-                            station_id = StationIdentifier.query.filter_by(identifier=station_identifier).first()
-                            exists = False
-
-                            if station_id:
-                                exists = True
-
-                            station_id = StationIdentifier(**station_id_data)
-
-                            if exists:
-                                logging.info('[STATION ID]: UPDATE')
-                                db.session.merge(station_id)
-                            else:
-                                logging.info('[STATION ID]: ADD')
-                                db.session.add(station_id)
-                            db.session.commit()
-
-        except Exception as e:
-            logging.error(e)
-            db.session.rollback()
-            pass
+                logging.info(f"[OBS]: Decoding '{os.path.basename(file_path)}'...")
+                future = executor.submit(decode_timestep, file_path, timestep.isoformat(), 1)
+                futures.append((ledger_id, timestep, future))
+                return
+
+        # keep a bounded number of decoded timesteps waiting to be loaded
+        for _ in range(workers * 2):
+            submit()
+
+        # load in timestep order
+        while futures:
+            ledger_id, timestep, future = futures.popleft()
+            submit()
+
+            try:
+                rows, decode_duration = future.result()
+                ingest_rows(ledger_id, timestep, rows, decode_duration, station_map)
+            except Exception as e:
+                logging.error(f"[OBS]: Error ingesting data for date '{timestep.isoformat()}': {e}")
+                db.session.rollback()
+                fail_file(ledger_id, e)
+
+    logging.info('[OBS]: Done catching up')
 
 
 @click.command(name="load_observations")
-def load_observations():
+@click.option("--catch-up", "catch_up", is_flag=True,
+              help="Ingest every available timestep newer than the state or missing from the database")
+@click.option("--workers", type=int, default=INGEST_WORKERS, help="Number of timesteps to decode concurrently")
+def load_observations(catch_up, workers):
     if os.path.exists(DATASETS_DIR):
-        state = read_state()
+        if catch_up:
+            catch_up_observations(workers)
+            return
 
-        last_update = state.get("last_update")
+        last_update = get_last_ingested_timestep()
 
         if last_update:
-            next_update = get_next_available_timestep(last_update)
+            next_update = get_next_available_timestep(last_update.isoformat())
         else:
             date_str = datetime.datetime.now().isoformat()
             next_update = get_next_available_timestep(date_str)
@@ -183,31 +332,44 @@ def load_observations():
         if next_update:
             next_update_str = next_update.isoformat()
             logging.info(f'[OBS]: Trying ingestion for date {next_update_str}...')
-            d_str = next_update.strftime("%Y%m%d%H%M")
-            f_name = f"SYNA0001_{d_str}_180.DAT"
+            f_name = get_timestep_file_name(next_update)
 
             file_path = os.path.join(DATASETS_DIR, f_name)
 
             if os.path.exists(file_path):
                 logging.info(f'[OBS]: Found data for date: {next_update_str}. Starting processing..')
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    out_bufr4 = os.path.join(temp_dir, "out.DAT")
+                ingest_file(next_update, file_path)
+
+            else:
+                logging.warning(f'[OBS]: Data not found for date: {next_update_str}. Skipping...')
 
-                    logging.info(f"[OBS]: Converting '{f_name}' to bufr edition 4...")
-                    convert_bufr3(file_path, out_bufr4)
 
-                    logging.info(f"[OBS]: Converting to Geojson...")
-                    geojson = bufr2geojson(out_bufr4, next_update_str)
+@click.command(name="ingest_worker")
+@click.option("--workers", type=int, default=INGEST_WORKERS,
+              help="Number of timesteps to decode concurrently when catching up")
+def ingest_worker(workers):
+    if not os.path.exists(DATASETS_DIR):
+        logging.error(f"[WORKER]: Datasets directory {DATASETS_DIR} does not exist")
+        return
 
-                logging.info(f"[OBS]: Ingesting to database...")
-                # load observation to database
-                load_obs_from_geojson(geojson)
+    # watch before catching up so files arriving meanwhile are not missed
+    watcher = watch_timestep_files(DATASETS_DIR, INGEST_POLL_INTERVAL)
 
-                logging.info(f"[OBS]: Done ingesting for date '{next_update_str}'...")
+    logging.info("[WORKER]: Catching up before processing new files")
+    catch_up_observations(workers)
 
-                logging.info(f"[OBS]: Updating state with '{next_update_str}'...")
-                # update state
-                update_state(next_update_str)
+    station_map = load_station_map()
+    station_map_time = time.monotonic()
 
-            else:
-                logging.warning(f'[OBS]: Data not found for date: {next_update_str}. Skipping...')
+    for file_path in watcher:
+        f_name = os.path.basename(file_path)
+        timestep = datetime.datetime.strptime(TIMESTEP_FILE_PATTERN.match(f_name).group(1), "%Y%m%d%H%M")
+
+        logging.info(f"[WORKER]: Found '{f_name}'. Starting processing..")
+
+        # pick up stations loaded from OSCAR since the map was built
+        if time.monotonic() - station_map_time > STATION_MAP_TTL:
+            station_map = load_station_map()
+            station_map_time = time.monotonic()
+
+        ingest_file(timestep, file_path, station_map)
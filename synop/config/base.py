@@ -13,6 +13,20 @@ SETTINGS = {
     'SQLALCHEMY_DATABASE_URI': os.getenv('SQLALCHEMY_DATABASE_URI'),
     'STATE_DIR': os.getenv('STATE_DIR'),
     'DATASETS_DIR': os.getenv('DATASETS_DIR'),
+    'DECODE_WORKERS': int(os.getenv('DECODE_WORKERS', 1)),
+    'INGEST_WORKERS': int(os.getenv('INGEST_WORKERS', 2)),
+    'INGEST_POLL_INTERVAL': int(os.getenv('INGEST_POLL_INTERVAL', 30)),
+    'STATION_MAP_TTL': int(os.getenv('STATION_MAP_TTL', 3600)),
+    'INGEST_CLAIM_TIMEOUT': int(os.getenv('INGEST_CLAIM_TIMEOUT', 3600)),
+    'OSCAR_WORKERS': int(os.getenv('OSCAR_WORKERS', 4)),
+    'OSCAR_CACHE_DIR': os.getenv('OSCAR_CACHE_DIR'),
+    'OSCAR_CACHE_TTL': int(os.getenv('OSCAR_CACHE_TTL', 86400)),
+    'TILE_CACHE_DIR': os.getenv('TILE_CACHE_DIR'),
+    'TILE_CACHE_SIZE': int(os.getenv('TILE_CACHE_SIZE', 1024)),
+    'TILE_CACHE_MAX_ZOOM': int(os.getenv('TILE_CACHE_MAX_ZOOM', 8)),
+    'TILE_CACHE_DISK_SIZE': int(os.getenv('TILE_CACHE_DISK_SIZE', 1024 * 1024 * 1024)),
+    'TILE_SEED_MAX_ZOOM': int(os.getenv('TILE_SEED_MAX_ZOOM', 2)),
+    'API_CACHE_MAX_AGE': int(os.getenv('API_CACHE_MAX_AGE', 60)),
     'ITEMS_PER_PAGE': int(os.getenv('ITEMS_PER_PAGE', 20)),
     'UPLOAD_FOLDER': '/tmp/datasets',
     'ROLLBAR_SERVER_TOKEN': os.getenv('ROLLBAR_SERVER_TOKEN'),
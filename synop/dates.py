@@ -0,0 +1,21 @@
+from datetime import datetime, timezone
+
+
+def parse_date(value):
+    value = value.strip()
+
+    # dates are returned as ...T00:00:00.000Z, which fromisoformat only accepts from python 3.11
+    if value[-1:] in ("Z", "z"):
+        value = value[:-1] + "+00:00"
+
+    date = datetime.fromisoformat(value)
+
+    # observation times are stored as naive UTC
+    if date.tzinfo:
+        date = date.astimezone(timezone.utc).replace(tzinfo=None)
+
+    return date
+
+
+def format_date(date):
+    return date.replace(tzinfo=timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.000Z")
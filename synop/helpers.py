@@ -1,6 +1,14 @@
+import hashlib
 from contextlib import contextmanager
+from functools import wraps
+
+from flask import request, make_response
 
 from synop import db
+from synop.config import SETTINGS
+from synop.utils import get_generations
+
+API_CACHE_MAX_AGE = SETTINGS.get("API_CACHE_MAX_AGE")
 
 
 @contextmanager
@@ -11,3 +19,36 @@ def transaction():
     except Exception:
         db.session.rollback()
         raise
+
+
+def conditional(*generations):
+    """Answer with a strong ETag derived from the ingest generations and the request url,
+    and with 304 when the client already holds the current version.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            current = get_generations(generations)
+            version = ":".join(str(current[name].value) if name in current else "0" for name in generations)
+            etag = hashlib.sha1(f"{version}:{request.full_path}".encode()).hexdigest()
+            last_modified = max((g.updated_at for g in current.values() if g.updated_at), default=None)
+
+            if request.if_none_match.contains(etag):
+                response = make_response("", 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+
+                if response.status_code != 200:
+                    return response
+
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            response.cache_control.public = True
+            response.cache_control.max_age = API_CACHE_MAX_AGE
+            response.cache_control.must_revalidate = True
+
+            return response
+
+        return wrapper
+
+    return decorator
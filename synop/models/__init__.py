@@ -5,4 +5,4 @@ def dump_datetime(value):
     return [value.strftime("%Y-%m-%d"), value.strftime("%H:%M:%S")]
 
 
-from synop.models.synop import Station, Observation, StationIdentifier
+from synop.models.synop import Station, Observation, StationIdentifier, IngestFile, Timestep, Statistic, Generation
@@ -52,6 +52,15 @@ class Station(db.Model):
         return station
 
 
+# station fields carried by decoded station records alongside observations
+station_columns = [
+    'wigos_id',
+    'station_or_site_name',
+    'longitude',
+    'latitude',
+    'elevation',
+]
+
 rename_columns = {
     "24hour_pressure_change": "pressure_change_24hour",
     "3hour_pressure_change": "pressure_change_3hour",
@@ -110,11 +119,15 @@ class Observation(db.Model):
     __tablename__ = "synop_observation"
     __table_args__ = (
         db.UniqueConstraint('wigos_id', 'time', name='unique_station_time'),
+        # keyset pages over the stations of a timestep
+        db.Index('idx_synop_observation_time_wigos_id', 'time', 'wigos_id'),
+        # monthly partitions are created by the loader, see ensure_observation_partitions
+        {'postgresql_partition_by': 'RANGE (time)'},
     )
 
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     wigos_id = db.Column(db.String(256), db.ForeignKey('synop_station.wigos_id', ondelete="CASCADE"), nullable=False)
-    time = db.Column(db.DateTime(), nullable=False)
+    time = db.Column(db.DateTime(), primary_key=True, nullable=False)
     non_coordinate_pressure = db.Column(db.Float, nullable=True)
     pressure_reduced_to_mean_sea_level = db.Column(db.Float, nullable=True)
     wind_direction_at10m = db.Column(db.Float, nullable=True)
@@ -180,9 +193,83 @@ class Observation(db.Model):
         return obs
 
 
+class Timestep(db.Model):
+    __tablename__ = "synop_timestep"
+
+    time = db.Column(db.DateTime(), primary_key=True)
+    station_count = db.Column(db.Integer, nullable=False, default=0)
+    observation_count = db.Column(db.Integer, nullable=False, default=0)
+    parameter_count = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(), nullable=True)
+
+    def __repr__(self):
+        return '<Timestep %r>' % self.time
+
+
+class Statistic(db.Model):
+    __tablename__ = "synop_statistics"
+    __table_args__ = (
+        db.Index('idx_synop_statistics_time_parameter', 'time', 'parameter'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    time = db.Column(db.DateTime(), nullable=False)
+    territory = db.Column(db.String(256), nullable=True)
+    parameter = db.Column(db.String(256), nullable=False)
+    station_count = db.Column(db.Integer, nullable=False)
+    minimum = db.Column(db.Float, nullable=True)
+    maximum = db.Column(db.Float, nullable=True)
+    mean = db.Column(db.Float, nullable=True)
+
+    def serialize(self):
+        """Return object data in easily serializable format"""
+        return {
+            "count": self.station_count,
+            "min": self.minimum,
+            "max": self.maximum,
+            "mean": self.mean,
+        }
+
+
+class Generation(db.Model):
+    __tablename__ = "synop_generation"
+
+    name = db.Column(db.String(64), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime(), nullable=True)
+
+    def __repr__(self):
+        return '<Generation %r>' % self.name
+
+
 class StationIdentifier(db.Model):
     __tablename__ = "synop_station_identifier"
+    __table_args__ = (
+        db.UniqueConstraint('identifier', name='unique_station_identifier'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     wigos_id = db.Column(db.String(256), db.ForeignKey('synop_station.wigos_id', ondelete="CASCADE"), nullable=False)
     identifier = db.Column(db.String(256), nullable=False)
+
+
+class IngestFile(db.Model):
+    __tablename__ = "synop_ingest_file"
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(256), nullable=False, unique=True)
+    time = db.Column(db.DateTime(), nullable=False, index=True)
+    size = db.Column(db.BigInteger, nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)
+    status = db.Column(db.String(32), nullable=False)
+    station_count = db.Column(db.Integer, nullable=True)
+    observation_count = db.Column(db.Integer, nullable=True)
+    failed_count = db.Column(db.Integer, nullable=True)
+    decode_duration = db.Column(db.Float, nullable=True)
+    load_duration = db.Column(db.Float, nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    claimed_at = db.Column(db.DateTime(), nullable=True)
+    completed_at = db.Column(db.DateTime(), nullable=True)
+
+    def __repr__(self):
+        return '<IngestFile %r>' % self.name
@@ -1,109 +1,377 @@
 import logging
 
-import pytz
-from flask import request, jsonify
+from flask import current_app, request, jsonify, url_for, Response, stream_with_context
 from sqlalchemy import and_, func
 
 from synop import db
-from synop.models import Observation, Station
+from synop.cache import tile_cache
+from synop.dates import parse_date, format_date
+from synop.helpers import conditional
+from synop.models import Observation, Station, Statistic, Timestep
 from synop.routes.api.v1 import endpoints
+from synop.services.synop_service import SynopService, pa
+from synop.utils import observation_parameters, get_observation_tile
+
+MVT_MIMETYPE = "application/vnd.mapbox-vector-tile"
+MAX_ITEMS_PER_PAGE = 1000
+
+
+def get_list(args, name):
+    # accept both repeated and comma separated values
+    values = []
+    for value in args.getlist(name):
+        values.extend(item.strip() for item in value.split(',') if item.strip())
+
+    return values
+
+
+def get_page(args, default_limit=None):
+    cursor = args.get('cursor')
+    limit = args.get('limit')
+
+    if limit is not None:
+        try:
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f'limit must be an integer, got {limit!r}')
+    elif cursor:
+        limit = current_app.config['ITEMS_PER_PAGE']
+    else:
+        limit = default_limit
+
+    if limit is not None and not 0 < limit <= MAX_ITEMS_PER_PAGE:
+        raise ValueError(f'limit must be between 1 and {MAX_ITEMS_PER_PAGE}')
+
+    return cursor, limit
+
+
+def get_area(args):
+    area = {}
+
+    bbox = get_list(args, 'bbox')
+    if bbox:
+        bbox = [float(value) for value in bbox]
+        if len(bbox) != 4:
+            raise ValueError('bbox must be minx,miny,maxx,maxy')
+        area['bbox'] = bbox
+
+    lon = args.get('lon', type=float)
+    lat = args.get('lat', type=float)
+    radius = args.get('radius', type=float)
+    nearest = args.get('nearest', type=int)
+
+    if radius is not None or nearest is not None:
+        if lon is None or lat is None or not -180 <= lon <= 180 or not -90 <= lat <= 90:
+            raise ValueError('radius and nearest require a valid lon and lat')
+
+        area['point'] = (lon, lat)
+
+    if radius is not None:
+        if radius <= 0:
+            raise ValueError('radius must be positive, in meters')
+        area['radius'] = radius
+
+    if nearest is not None:
+        if not 0 < nearest <= MAX_ITEMS_PER_PAGE:
+            raise ValueError(f'nearest must be between 1 and {MAX_ITEMS_PER_PAGE}')
+        if args.get('cursor'):
+            raise ValueError('nearest can not be paginated')
+        area['nearest'] = nearest
+
+    return area
+
+
+def set_next_page(response, cursor):
+    url = url_for(request.endpoint, _external=True, **{**request.args.to_dict(flat=False), **request.view_args, 'cursor': cursor})
+
+    response.headers['Link'] = f'<{url}>; rel="next"'
+
+
+def get_parameters(args):
+    parameters = get_list(args, 'parameters')
+
+    invalid = [param for param in parameters if param not in observation_parameters]
+
+    return parameters, invalid
 
 
 @endpoints.route('/dates', strict_slashes=False, methods=['GET'])
+@conditional('observations')
 def get_available_dates():
     logging.info('[ROUTER]: Getting available dates')
 
-    distinct_dates = Observation.query.with_entities(Observation.time).distinct().order_by(Observation.time).all()
-    response = [date[0].replace(tzinfo=pytz.UTC).strftime("%Y-%m-%dT%H:%M:%S.000Z") for date in distinct_dates]
+    distinct_dates = Timestep.query.with_entities(Timestep.time).order_by(Timestep.time).all()
+    response = [format_date(date[0]) for date in distinct_dates]
 
     return jsonify(response), 200
 
 
 # Download country Stations data as csv
 @endpoints.route('/stations', strict_slashes=False, methods=['GET'])
+@conditional('observations', 'stations')
 def get_country_stations_data():
     args = request.args
     country = args.get('country')
     data_format = args.get('format')
 
-    if not country:
-        stations = Station.query.all()
-    else:
-        stations = Station.query.filter_by(territory=country).all()
+    try:
+        cursor, limit = get_page(args)
+        area = get_area(args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    if not stations:
+    # assembled in the database and sent as is
+    stations, count, last = SynopService.stations_json(
+        country, as_geojson=data_format == 'geojson', cursor=cursor, limit=limit, area=area
+    )
+
+    if not count and not cursor:
         logging.error(f'[ROUTER]: No stations found')
         return jsonify(f'No stations found for country'), 404
 
-    if data_format == 'geojson':
-        stations = {
-            "type": "FeatureCollection",
-            "features": [station.serialize(as_geojson=True) for station in stations],
-        }
-    else:
-        stations = [station.serialize() for station in stations]
+    response = Response(stations, mimetype='application/json')
+
+    if limit and count == limit and not area.get('nearest'):
+        set_next_page(response, last)
+
+    return response, 200
 
-    return jsonify(stations), 200
 
+# time series of a station
+@endpoints.route('/stations/<wigos_id>/observations', strict_slashes=False, methods=['GET'])
+@conditional('observations')
+def get_station_observations(wigos_id):
+    args = request.args
+    parameters, invalid = get_parameters(args)
+
+    if invalid:
+        return jsonify({"error": f"Invalid parameter: {invalid[0]}"}), 400
+
+    try:
+        start = parse_date(args.get('start')) if args.get('start') else None
+        end = parse_date(args.get('end')) if args.get('end') else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
+    if not db.session.get(Station, wigos_id):
+        return jsonify(f'Station {wigos_id} not found'), 404
+
+    parameters = parameters or observation_parameters
+    times, values = SynopService.station_timeseries(wigos_id, parameters, start=start, end=end)
 
-# Download gts data as csv
+    return jsonify({
+        "wigos_id": wigos_id,
+        "parameters": parameters,
+        "time": [format_date(time) for time in times],
+        "values": values,
+    }), 200
+
+
+# list the observations at a date, a page at a time
+@endpoints.route('/observations', strict_slashes=False, methods=['GET'])
+@conditional('observations', 'stations')
+def get_observations():
+    args = request.args
+    country = args.get('country')
+    date = args.get('date')
+    fields = get_list(args, 'fields')
+
+    invalid = [field for field in fields if field not in observation_parameters]
+
+    if invalid:
+        return jsonify({"error": f"Invalid field: {invalid[0]}"}), 400
+
+    try:
+        cursor, limit = get_page(args, current_app.config['ITEMS_PER_PAGE'])
+        area = get_area(args)
+        time = parse_date(date) if date else db.session.query(func.max(Timestep.time)).scalar()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not time:
+        return jsonify('No data available'), 404
+
+    observations = SynopService.observations_page(
+        time, fields or observation_parameters, cursor=cursor, limit=limit, country=country, area=area
+    )
+
+    next_cursor = None
+    if len(observations) == limit and not area.get('nearest'):
+        next_cursor = observations[-1]["wigos_id"]
+
+    response = jsonify({
+        "date": format_date(time),
+        "observations": observations,
+        "next_cursor": next_cursor,
+    })
+
+    if next_cursor:
+        set_next_page(response, next_cursor)
+
+    return response, 200
+
+
+# Download observations data as csv, ndjson or parquet
 @endpoints.route('/download', strict_slashes=False, methods=['GET'])
 def get_country_observation_data():
     logging.info('[ROUTER]: Downloading station data')
 
-    return jsonify('Not implemented yet'), 501
+    args = request.args
+    country = args.get('country')
+    data_format = args.get('format', 'csv')
+    stations = get_list(args, 'stations')
+    parameters, invalid = get_parameters(args)
+
+    if data_format not in SynopService.EXPORT_FORMATS:
+        return jsonify({"error": f"Invalid format: {data_format}"}), 400
+
+    if data_format == 'parquet' and pa is None:
+        return jsonify('Parquet export is not available'), 501
 
+    if invalid:
+        return jsonify({"error": f"Invalid parameter: {invalid[0]}"}), 400
 
-# get statistics for a specific date
+    try:
+        start = parse_date(args.get('start')) if args.get('start') else None
+        end = parse_date(args.get('end')) if args.get('end') else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
+    mimetype, extension = SynopService.EXPORT_FORMATS[data_format]
+    stream = SynopService.export_observations(
+        data_format,
+        parameters or observation_parameters,
+        country=country,
+        start=start,
+        end=end,
+        stations=stations,
+    )
+
+    return Response(
+        stream_with_context(stream),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename=synop_{country or 'all'}.{extension}"},
+    )
+
+
+# get statistics for a specific date or date range
 @endpoints.route('/statistics', strict_slashes=False, methods=['GET'])
+@conditional('observations', 'stations')
 def get_statistics():
     logging.info(f'[ROUTER]: Getting statistics')
 
     args = request.args
     date = args.get('date')
-    parameters = args.get('parameters')
-
-    if not date:
-        # get latest available date
-        date = Observation.query.with_entities(Observation.time).distinct().order_by(Observation.time.desc()).first()
-        date = date[0].replace(tzinfo=pytz.UTC).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+    start = args.get('start')
+    end = args.get('end')
+    parameters, invalid = get_parameters(args)
 
     if not parameters:
         return jsonify('No parameters provided'), 400
 
-    if isinstance(parameters, str):
-        parameters = [parameters]
+    if invalid:
+        return jsonify({"error": f"Invalid parameter: {invalid[0]}"}), 400
+
+    try:
+        start = parse_date(start) if start else None
+        end = parse_date(end) if end else None
+        time = parse_date(date) if date else None
+    except ValueError as e:
+        return jsonify({"error": f"Invalid date: {e}"}), 400
+
+    if not date and not start and not end:
+        # get latest available date
+        time = db.session.query(func.max(Timestep.time)).scalar()
+
+        if not time:
+            return jsonify('No data available'), 404
 
-    for param in parameters:
-        if not hasattr(Observation, param):
-            return jsonify({"error": f"Invalid parameter: {param}"}), 400
+        date = format_date(time)
 
-    # Construct the query
     try:
-        query_filters = [Observation.time == date]
-        for param in parameters:
-            query_filters.append(getattr(Observation, param) != None)
-
-        # Join with Station table to get territory
-        query = db.session.query(
-            Station.territory,
-            func.count(Observation.wigos_id.distinct()).label('station_count')
-        ).join(
-            Observation, Observation.wigos_id == Station.wigos_id
-        ).filter(
-            and_(*query_filters)
-        ).group_by(
-            Station.territory
-        ).all()
+        # per parameter and territory rollups computed at ingest
+        query = Statistic.query.filter(Statistic.parameter.in_(parameters))
+
+        if time:
+            query = query.filter(Statistic.time == time)
+        else:
+            if start:
+                query = query.filter(Statistic.time >= start)
+            if end:
+                query = query.filter(Statistic.time <= end)
+
+        statistics = {}
+        for statistic in query.order_by(Statistic.time).all():
+            date_statistics = statistics.setdefault(format_date(statistic.time), {})
+            date_statistics.setdefault(statistic.parameter, {})[statistic.territory or ''] = statistic.serialize()
+
+        if not time:
+            return jsonify({
+                "start": format_date(start) if start else None,
+                "end": format_date(end) if end else None,
+                "parameters": parameters,
+                "statistics": statistics,
+            })
+
+        if len(parameters) == 1:
+            summary = {
+                territory: values["count"]
+                for territory, values in statistics.get(format_date(time), {}).get(parameters[0], {}).items()
+            }
+        else:
+            # stations reporting all the parameters can not be derived from the rollups
+            query_filters = [Observation.time == time]
+            for param in parameters:
+                query_filters.append(getattr(Observation, param) != None)
+
+            # Join with Station table to get territory
+            query = db.session.query(
+                Station.territory,
+                func.count(Observation.wigos_id.distinct()).label('station_count')
+            ).join(
+                Observation, Observation.wigos_id == Station.wigos_id
+            ).filter(
+                and_(*query_filters)
+            ).group_by(
+                Station.territory
+            ).all()
+
+            summary = {territory or '': count for territory, count in query}
 
         # Format the results
         results = {
             "date": date,
             "parameters": parameters,
-            "summary": {territory: count for territory, count in query},
+            "summary": summary,
+            "statistics": statistics,
         }
 
         return jsonify(results)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+# vector tile of the observations at a date
+@endpoints.route('/tiles/<date>/<int:z>/<int:x>/<int:y>.pbf', strict_slashes=False, methods=['GET'])
+def get_tile(date, z, x, y):
+    try:
+        date = parse_date(date)
+    except ValueError:
+        return jsonify(f'Invalid date: {date}'), 400
+
+    if z > 22 or x >= 2 ** z or y >= 2 ** z:
+        return jsonify(f'Invalid tile: {z}/{x}/{y}'), 400
+
+    parameters, invalid = get_parameters(request.args)
+
+    if invalid:
+        return jsonify({"error": f"Invalid parameter: {invalid[0]}"}), 400
+
+    # only ingested dates are rendered, and so cached
+    if not db.session.get(Timestep, date):
+        return jsonify(f'No data available for date {format_date(date)}'), 404
+
+    tile = tile_cache.get(date, z, x, y, parameters, get_observation_tile)
+
+    return Response(tile, mimetype=MVT_MIMETYPE), 200
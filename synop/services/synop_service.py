@@ -1,7 +1,316 @@
+import csv
+import io
+import json
+import math
+
+from geoalchemy2 import Geography
+from sqlalchemy import cast, func, or_, select, text
+
+from synop import db
 from synop.config import SETTINGS
+from synop.models import Observation, Station
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
 
 PG_SERVICE_SCHEMA = SETTINGS.get('PG_SERVICE_SCHEMA')
 
+# shortest degree of latitude (at the equator) and longest degree of longitude on WGS84,
+# so boxes derived from them always contain the true circle
+MIN_METERS_PER_DEGREE_LATITUDE = 110574
+MAX_METERS_PER_DEGREE_LONGITUDE = 111320
+GEOGRAPHY = Geography(geometry_type=None)
+
+# rows fetched per round trip from the server side cursor
+EXPORT_CHUNK_SIZE = 5000
+
+station_export_columns = [
+    Station.wigos_id,
+    Station.name,
+    Station.territory.label("country"),
+    Station.longitude,
+    Station.latitude,
+    Station.elevation,
+    Observation.time,
+]
+
+
+class ParquetSink(io.RawIOBase):
+    """Write only file that hands back what was written since the last call to pop.
+
+    Parquet footers record absolute offsets, so the position keeps counting after the
+    data has been sent.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        self.position += len(b)
+        return len(b)
+
+    def tell(self):
+        return self.position
+
+    def pop(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
 
 class SynopService(object):
-    pass
+
+    STATION_PROPERTIES = """
+        json_build_object(
+            'wigos_id', s.wigos_id,
+            'name', s.name,
+            'country', s.territory,
+            'longitude', s.longitude,
+            'latitude', s.latitude,
+            'elevation', s.elevation
+        )
+    """
+
+    EXPORT_FORMATS = {
+        "csv": ("text/csv", "csv"),
+        "ndjson": ("application/x-ndjson", "ndjson"),
+        "parquet": ("application/vnd.apache.parquet", "parquet"),
+    }
+
+    @staticmethod
+    def radius_boxes(lon, lat, radius):
+        """Boxes (minx, miny, maxx, maxy) covering a radius in meters around a point, split in two
+        when crossing the antimeridian"""
+        # padded, the boxes only pre-filter for ST_DWithin and must contain the whole circle
+        dy = radius / MIN_METERS_PER_DEGREE_LATITUDE * 1.01
+        min_lat = max(lat - dy, -90)
+        max_lat = min(lat + dy, 90)
+
+        widest = max(abs(min_lat), abs(max_lat))
+        if widest >= 89.9:
+            return [(-180, min_lat, 180, max_lat)]
+
+        dx = radius / (MAX_METERS_PER_DEGREE_LONGITUDE * math.cos(math.radians(widest))) * 1.01
+        if dx >= 180:
+            return [(-180, min_lat, 180, max_lat)]
+
+        min_lon = lon - dx
+        max_lon = lon + dx
+
+        if min_lon < -180:
+            return [(min_lon + 360, min_lat, 180, max_lat), (-180, min_lat, max_lon, max_lat)]
+        if max_lon > 180:
+            return [(min_lon, min_lat, 180, max_lat), (-180, min_lat, max_lon - 360, max_lat)]
+
+        return [(min_lon, min_lat, max_lon, max_lat)]
+
+    @staticmethod
+    def area_filter(query, area):
+        """Restrict a query joined to stations to a bbox, a radius around a point, or the k nearest
+        stations to a point, all served by the station geom index"""
+        if not area:
+            return query
+
+        if area.get("bbox"):
+            envelope = func.ST_MakeEnvelope(*area["bbox"], 4326)
+            query = query.where(func.ST_Intersects(Station.geom, envelope))
+
+        if area.get("point"):
+            lon, lat = area["point"]
+            point = func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326)
+
+            if area.get("radius"):
+                radius = area["radius"]
+
+                # index friendly bounding boxes in degrees, then the exact distance on the spheroid
+                query = query.where(
+                    or_(*[Station.geom.op("&&")(func.ST_MakeEnvelope(*box, 4326))
+                          for box in SynopService.radius_boxes(lon, lat, radius)]),
+                    func.ST_DWithin(cast(Station.geom, GEOGRAPHY), cast(point, GEOGRAPHY), radius),
+                )
+
+            if area.get("nearest"):
+                # KNN ordering on the GiST index
+                query = query.order_by(None).order_by(Station.geom.op("<->")(point)).limit(area["nearest"])
+
+        return query
+
+    @staticmethod
+    def stations_json(country=None, as_geojson=False, cursor=None, limit=None, area=None):
+        """Serialize stations to json in the database, returns the json text, the station count and
+        the last wigos_id of the page"""
+        query = select(Station.__table__)
+
+        if country:
+            query = query.where(Station.territory == country)
+        if cursor:
+            query = query.where(Station.wigos_id > cursor)
+
+        # keyset pagination on the primary key, no limit returns every station
+        query = SynopService.area_filter(query.order_by(Station.wigos_id).limit(limit), area)
+
+        order = "s.wigos_id"
+        if area and area.get("nearest"):
+            lon, lat = area["point"]
+            query = query.add_columns(
+                Station.geom.op("<->")(func.ST_SetSRID(func.ST_MakePoint(lon, lat), 4326)).label("distance")
+            )
+            order = "s.distance"
+
+        if as_geojson:
+            item = f"""
+                json_build_object(
+                    'type', 'Feature',
+                    'geometry', ST_AsGeoJSON(s.geom)::json,
+                    'properties', {SynopService.STATION_PROPERTIES}
+                )
+            """
+        else:
+            item = SynopService.STATION_PROPERTIES
+
+        items = f"coalesce(json_agg({item} ORDER BY {order}), '[]'::json)"
+
+        if as_geojson:
+            items = f"json_build_object('type', 'FeatureCollection', 'features', {items})"
+
+        stations = query.subquery("s")
+
+        return db.session.execute(
+            select(text(f"{items}::text"), func.count(), func.max(stations.c.wigos_id)).select_from(stations)
+        ).one()
+
+    @staticmethod
+    def observations_page(time, fields, cursor=None, limit=None, country=None, area=None):
+        columns = [Observation.wigos_id] + [getattr(Observation, field) for field in fields]
+
+        query = select(*columns).where(Observation.time == time)
+
+        if country or area:
+            query = query.join(Station, Station.wigos_id == Observation.wigos_id)
+        if country:
+            query = query.where(Station.territory == country)
+        if cursor:
+            query = query.where(Observation.wigos_id > cursor)
+
+        # served from idx_synop_observation_time_wigos_id, unless nearest first
+        query = SynopService.area_filter(query.order_by(Observation.wigos_id).limit(limit), area)
+
+        return [row._asdict() for row in db.session.execute(query)]
+
+    @staticmethod
+    def station_timeseries(wigos_id, parameters, start=None, end=None):
+        columns = [Observation.time] + [getattr(Observation, param) for param in parameters]
+
+        # (wigos_id, time) is the leading part of unique_station_time
+        query = select(*columns).where(Observation.wigos_id == wigos_id)
+
+        if start:
+            query = query.where(Observation.time >= start)
+        if end:
+            query = query.where(Observation.time <= end)
+
+        rows = db.session.execute(query.order_by(Observation.time)).all()
+
+        # one array per column
+        columns = list(zip(*rows)) or [()] * len(columns)
+
+        return list(columns[0]), {param: list(values) for param, values in zip(parameters, columns[1:])}
+
+    @staticmethod
+    def observations_query(parameters, country=None, start=None, end=None, stations=None):
+        columns = station_export_columns + [getattr(Observation, param) for param in parameters]
+
+        query = select(*columns).join(Observation, Observation.wigos_id == Station.wigos_id)
+
+        if country:
+            query = query.where(Station.territory == country)
+        if start:
+            query = query.where(Observation.time >= start)
+        if end:
+            query = query.where(Observation.time <= end)
+        if stations:
+            query = query.where(Observation.wigos_id.in_(stations))
+
+        # unique_station_time order, so rows stream from index scans instead of a sort of the range
+        return query.order_by(Observation.wigos_id, Observation.time)
+
+    @staticmethod
+    def stream_observations(query):
+        # yield_per makes psycopg2 use a named server side cursor
+        result = db.session.execute(query.execution_options(yield_per=EXPORT_CHUNK_SIZE))
+
+        try:
+            for rows in result.partitions():
+                yield result.keys(), rows
+        finally:
+            result.close()
+
+    @staticmethod
+    def export_csv(query):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        header = False
+
+        for keys, rows in SynopService.stream_observations(query):
+            if not header:
+                writer.writerow(keys)
+                header = True
+
+            writer.writerows(rows)
+
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    @staticmethod
+    def export_ndjson(query):
+        for keys, rows in SynopService.stream_observations(query):
+            yield "".join(json.dumps(dict(zip(keys, row)), default=str) + "\n" for row in rows)
+
+    @staticmethod
+    def export_parquet(query, parameters):
+        schema = pa.schema(
+            [
+                ("wigos_id", pa.string()),
+                ("name", pa.string()),
+                ("country", pa.string()),
+                ("longitude", pa.float64()),
+                ("latitude", pa.float64()),
+                ("elevation", pa.float64()),
+                ("time", pa.timestamp("s")),
+            ] + [(param, pa.float64()) for param in parameters]
+        )
+
+        sink = ParquetSink()
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+
+        try:
+            # one row group per fetched chunk
+            for keys, rows in SynopService.stream_observations(query):
+                writer.write_table(pa.Table.from_pylist([dict(zip(keys, row)) for row in rows], schema=schema))
+                yield sink.pop()
+        finally:
+            writer.close()
+
+        yield sink.pop()
+
+    @staticmethod
+    def export_observations(data_format, parameters, **filters):
+        query = SynopService.observations_query(parameters, **filters)
+
+        if data_format == "parquet":
+            return SynopService.export_parquet(query, parameters)
+
+        if data_format == "ndjson":
+            return SynopService.export_ndjson(query)
+
+        return SynopService.export_csv(query)
@@ -1,20 +1,51 @@
+import hashlib
 import json
 import logging
 import os
+import re
 import shutil
 import stat
 import tempfile
+import time
 from datetime import datetime, timedelta
-from subprocess import Popen, PIPE
+
+from sqlalchemy import and_, case, delete, func, or_, select, text
+from sqlalchemy.dialects.postgresql import insert
+
+from pyoscar import OSCARClient
 
 from synop import db
-from synop.bufr2geojson import transform as as_geojson
+from synop.bufr2geojson import transform_file
 from synop.config import SETTINGS
-from synop.models import Station, StationIdentifier, Observation
-from synop.models.synop import rename_columns
+from synop.models import Station, StationIdentifier, Observation, IngestFile, Timestep, Statistic, Generation
+from synop.models.synop import rename_columns, obs_columns, station_columns
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
 
 STATE_DIR = SETTINGS.get("STATE_DIR")
-STATE_FILE = os.path.join(STATE_DIR, "state.json")
+DECODE_WORKERS = SETTINGS.get("DECODE_WORKERS")
+INGEST_CLAIM_TIMEOUT = SETTINGS.get("INGEST_CLAIM_TIMEOUT")
+OSCAR_CACHE_DIR = SETTINGS.get("OSCAR_CACHE_DIR") or os.path.join(STATE_DIR or "/tmp", "oscar")
+OSCAR_CACHE_TTL = SETTINGS.get("OSCAR_CACHE_TTL")
+
+# SYNOP bulletins, one file per 3-hourly timestep
+TIMESTEP_FILE_PATTERN = re.compile(r"^SYNA0001_(\d{12})_180\.DAT$")
+
+# number of observations per multi-row insert
+OBS_CHUNK_SIZE = 1000
+
+# number of stations or identifiers per multi-row insert
+STATION_CHUNK_SIZE = 1000
+
+# how long creating a partition may wait for the lock on synop_observation
+PARTITION_LOCK_TIMEOUT = "10s"
+
+# observation columns loaded from decoded station records
+observation_fields = [column.name for column in Observation.__table__.columns if column.name != "id"]
+observation_parameters = [column for column in observation_fields if column not in ("wigos_id", "time")]
 
 
 def copy_with_metadata(source, target):
@@ -61,34 +92,79 @@ def atomic_write(file_contents, target_file_path, mode="w"):
                 pass
 
 
-def write_empty_state():
-    content = {"last_update": ""}
-    atomic_write(json.dumps(content, indent=4), STATE_FILE)
-    return content
+def hash_file(file_path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
 
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def claim_file(file_path, timestep):
+    table = IngestFile.__table__
+
+    values = {
+        "name": os.path.basename(file_path),
+        "time": timestep,
+        "size": os.path.getsize(file_path),
+        "content_hash": hash_file(file_path),
+        "status": "processing",
+        "claimed_at": func.now(),
+    }
+
+    stmt = insert(table).values(values)
+    stale = func.now() - timedelta(seconds=INGEST_CLAIM_TIMEOUT)
+
+    # skip files already ingested with the same content, or being ingested by another worker
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={
+            "size": stmt.excluded.size,
+            "content_hash": stmt.excluded.content_hash,
+            "status": stmt.excluded.status,
+            "claimed_at": stmt.excluded.claimed_at,
+            "error": None,
+        },
+        where=and_(
+            or_(table.c.status != "done", table.c.content_hash.is_distinct_from(stmt.excluded.content_hash)),
+            or_(table.c.status != "processing", table.c.claimed_at < stale),
+        )
+    ).returning(table.c.id)
+
+    ledger_id = db.session.execute(stmt).scalar()
+    db.session.commit()
+
+    return ledger_id
+
+
+def complete_file(ledger_id, station_count, observation_count, failed_count, decode_duration, load_duration):
+    ledger = IngestFile.query.get(ledger_id)
+
+    ledger.status = "done"
+    ledger.station_count = station_count
+    ledger.observation_count = observation_count
+    ledger.failed_count = failed_count
+    ledger.decode_duration = decode_duration
+    ledger.load_duration = load_duration
+    ledger.completed_at = func.now()
+
+    db.session.commit()
 
-def read_state():
-    # create state file if it does not exist
-    if not os.path.isfile(STATE_FILE):
-        with open(STATE_FILE, mode='w') as f:
-            f.write("{}")
-    try:
-        logging.debug(f"[STATE]: Opening state file {STATE_FILE}")
-        with open(STATE_FILE, 'r') as f:
-            state = json.load(f)
-    except json.decoder.JSONDecodeError:
-        state = write_empty_state()
 
-    return state
+def fail_file(ledger_id, error):
+    ledger = IngestFile.query.get(ledger_id)
 
+    ledger.status = "failed"
+    ledger.error = str(error)
+    ledger.completed_at = func.now()
 
-def update_state(last_update):
-    with open(STATE_FILE, 'r') as f:
-        state = json.load(f)
+    db.session.commit()
 
-    state.update({"last_update": last_update})
 
-    atomic_write(json.dumps(state, indent=4), STATE_FILE)
+def get_last_ingested_timestep():
+    return db.session.query(func.max(IngestFile.time)).filter(IngestFile.status == "done").scalar()
 
 
 def get_next_available_timestep(datetime_str):
@@ -104,159 +180,584 @@ def get_next_available_timestep(datetime_str):
     return current_time
 
 
-def convert_bufr3(input_file, output_file):
-    cmd = ["bufr_set", "-s", "edition=4", input_file, output_file]
+def get_timestep_file_name(timestep):
+    d_str = timestep.strftime("%Y%m%d%H%M")
+    return f"SYNA0001_{d_str}_180.DAT"
 
-    p1 = Popen(cmd, stdout=PIPE, stderr=PIPE)
 
-    p1.stdout.close()
+def list_timestep_files(datasets_dir):
+    files = []
 
-    stdout, stderr = p1.communicate()
+    for f_name in os.listdir(datasets_dir):
+        match = TIMESTEP_FILE_PATTERN.match(f_name)
+        if match:
+            timestep = datetime.strptime(match.group(1), "%Y%m%d%H%M")
+            files.append((timestep, os.path.join(datasets_dir, f_name)))
 
-    if stderr:
-        raise Exception(stderr)
+    return sorted(files)
+
+
+def watch_timestep_files(datasets_dir, poll_interval):
+    # the watch is registered here rather than on the first next(), so files arriving
+    # while the caller is busy (e.g. catching up) are still reported
+    if INotify is not None:
+        try:
+            inotify = INotify()
+            inotify.add_watch(datasets_dir, flags.CLOSE_WRITE | flags.MOVED_TO)
+            logging.info(f"[WATCH]: Watching {datasets_dir} for new files")
+            return read_timestep_events(inotify, datasets_dir, poll_interval)
+        except OSError as e:
+            logging.warning(f"[WATCH]: Unable to watch {datasets_dir}, falling back to polling: {e}")
+
+    logging.info(f"[WATCH]: Polling {datasets_dir} every {poll_interval} seconds")
+
+    # only skip files already in the ledger, anything else is reported and claimed by the caller
+    ingested = get_ingested_timesteps()
+    seen = {file_path for timestep, file_path in list_timestep_files(datasets_dir) if timestep in ingested}
+
+    return poll_timestep_files(datasets_dir, poll_interval, seen)
+
+
+def read_timestep_events(inotify, datasets_dir, poll_interval):
+    while True:
+        for event in inotify.read(timeout=poll_interval * 1000):
+            if TIMESTEP_FILE_PATTERN.match(event.name):
+                yield os.path.join(datasets_dir, event.name)
+
+
+def poll_timestep_files(datasets_dir, poll_interval, seen):
+    sizes = {}
+
+    while True:
+        for _, file_path in list_timestep_files(datasets_dir):
+            if file_path in seen:
+                continue
+
+            # only pick files up once they have stopped growing
+            size = os.path.getsize(file_path)
+            if sizes.get(file_path) == size:
+                seen.add(file_path)
+                sizes.pop(file_path)
+                yield file_path
+            else:
+                sizes[file_path] = size
+
+        time.sleep(poll_interval)
+
+
+def get_ingested_timesteps(start=None, end=None):
+    query = db.session.query(IngestFile.time).filter(IngestFile.status == "done").distinct()
+
+    if start:
+        query = query.filter(IngestFile.time >= start)
+    if end:
+        query = query.filter(IngestFile.time <= end)
+
+    return {time for time, in query}
+
+
+def decode_timestep(bufr_path, time_str, workers=DECODE_WORKERS):
+    start = time.monotonic()
+    rows = bufr2rows(bufr_path, time_str, workers)
+
+    return rows, time.monotonic() - start
 
 
 def bufr2geojson(bufr_path, time_str):
-    with open(bufr_path, "rb") as fh:
-        logging.debug('Procesing BUFR data')
+    logging.debug('Procesing BUFR data')
 
-        logging.debug('Generating GeoJSON features')
-        results = as_geojson(fh.read(), serialize=False)
+    logging.debug('Generating GeoJSON features')
+    results = transform_file(bufr_path, serialize=False, workers=DECODE_WORKERS)
 
-        feature_collection = {}
+    feature_collection = {}
 
-        geojson = {"type": "FeatureCollection", "features": []}
+    geojson = {"type": "FeatureCollection", "features": []}
 
-        logging.debug('Processing GeoJSON features')
-        for collection in results:
-            for _, item in collection.items():
-                logging.debug('Parsing feature datetime')
-                data_date = item['_meta']['data_date']
-                if '/' in data_date:
-                    # date is range/period, split and get end date/time
-                    data_date = data_date.split('/')[1]
+    logging.debug('Processing GeoJSON features')
+    for collection in results:
+        for _, item in collection.items():
+            logging.debug('Parsing feature datetime')
+            data_date = item['_meta']['data_date']
+            if '/' in data_date:
+                # date is range/period, split and get end date/time
+                data_date = data_date.split('/')[1]
 
-                logging.debug('Parsing feature fields')
-                items_to_remove = [
-                    key for key in item if key not in ('geojson', '_meta')
-                ]
-                for key in items_to_remove:
-                    logging.debug(f'Removing unexpected key: {key}')
-                    item.pop(key)
+            logging.debug('Parsing feature fields')
+            items_to_remove = [
+                key for key in item if key not in ('geojson', '_meta')
+            ]
+            for key in items_to_remove:
+                logging.debug(f'Removing unexpected key: {key}')
+                item.pop(key)
 
-                if item.get("geojson"):
-                    feature = item.get("geojson")
-                    geometry = feature.get("geometry")
+            if item.get("geojson"):
+                feature = item.get("geojson")
+                geometry = feature.get("geometry")
 
-                    if geometry:
-                        f_properties = feature.get("properties")
-                        wigos_id = f_properties.get("wigos_station_identifier")
+                if geometry:
+                    f_properties = feature.get("properties")
+                    wigos_id = f_properties.get("wigos_station_identifier")
 
-                        if wigos_id:
-                            if feature_collection.get(wigos_id) is None:
-                                feature_collection[wigos_id] = {**feature, "properties": {}}
+                    if wigos_id:
+                        if feature_collection.get(wigos_id) is None:
+                            feature_collection[wigos_id] = {**feature, "properties": {}}
 
-                            feature_collection[wigos_id]["id"] = wigos_id
+                        feature_collection[wigos_id]["id"] = wigos_id
 
-                            metadata = f_properties.get("metadata") or []
-                            feature_collection[wigos_id]["metadata"] = {}
+                        metadata = f_properties.get("metadata") or []
+                        feature_collection[wigos_id]["metadata"] = {}
 
-                            # get station metadata
-                            for meta in metadata:
-                                if meta.get("name") == "station_or_site_name":
-                                    feature_collection[wigos_id]["metadata"]["station_or_site_name"] = meta.get(
-                                        "description")
-                                    break
+                        # get station metadata
+                        for meta in metadata:
+                            if meta.get("name") == "station_or_site_name":
+                                feature_collection[wigos_id]["metadata"]["station_or_site_name"] = meta.get(
+                                    "description")
+                                break
 
-                            final_properties = feature_collection[wigos_id].get("properties")
+                        final_properties = feature_collection[wigos_id].get("properties")
 
-                            for key in list(final_properties):
-                                if "->" in key:
-                                    final_properties.pop(key)
+                        for key in list(final_properties):
+                            if "->" in key:
+                                final_properties.pop(key)
 
-                            time = time_str
-                            name = f_properties.get("name")
-                            value = f_properties.get("value")
+                        time = time_str
+                        name = f_properties.get("name")
+                        value = f_properties.get("value")
 
-                            if time:
-                                final_properties.update({"time": time})
+                        if time:
+                            final_properties.update({"time": time})
 
-                            if name and value:
-                                final_properties.update({name: value})
+                        if name and value:
+                            final_properties.update({name: value})
 
-                            feature_collection[wigos_id]["properties"] = final_properties
+                        feature_collection[wigos_id]["properties"] = final_properties
 
-        for station_id, feature in feature_collection.items():
-            geojson["features"].append(feature)
+    for station_id, feature in feature_collection.items():
+        geojson["features"].append(feature)
 
     return geojson
 
 
+def bufr2rows(bufr_path, time_str, workers=DECODE_WORKERS):
+    logging.debug('Procesing BUFR data')
+
+    columns = set(obs_columns)
+    rows = {}
+
+    logging.debug('Generating station records')
+    for row in transform_file(bufr_path, workers=workers, columns=columns):
+        wigos_id = row.get("wigos_id")
+
+        if not wigos_id or row.get("longitude") is None or row.get("latitude") is None:
+            continue
+
+        if rows.get(wigos_id) is None:
+            rows[wigos_id] = row
+        else:
+            rows[wigos_id].update({key: val for key, val in row.items() if key in columns})
+
+        rows[wigos_id]["time"] = time_str
+
+    return list(rows.values())
+
+
+def feature_to_row(feature):
+    metadata = feature.get("metadata") or {}
+    coordinates = (feature.get("geometry") or {}).get("coordinates") or [None, None]
+
+    return {
+        **feature.get("properties"),
+        "wigos_id": feature.get("id"),
+        "station_or_site_name": metadata.get("station_or_site_name"),
+        "longitude": coordinates[0],
+        "latitude": coordinates[1],
+    }
+
+
 def load_obs_from_geojson(geojson):
-    for feature in geojson.get("features"):
-        wigos_id = feature.get("id")
-        station = Station.query.get(wigos_id)
-
-        if not station:
-            identifier = StationIdentifier.query.filter_by(identifier=wigos_id).first()
-
-            if identifier:
-                wigos_id = identifier.wigos_id
-                station = Station.query.get(wigos_id)
-
-        if not station:
-            metadata = feature.get("metadata")
-            if metadata and metadata.get("station_or_site_name"):
-                geom = feature.get("geometry").get("coordinates")
-
-                if geom:
-                    station_data = {
-                        "wigos_id": wigos_id,
-                        "name": metadata.get("station_or_site_name"),
-                        "longitude": geom[0],
-                        "latitude": geom[1],
-                    }
-
-                    station = Station(**station_data)
-
-                    try:
-                        logging.info('[STATION]: ADD')
-                        db.session.add(station)
-                        db.session.commit()
-                    except Exception as e:
-                        logging.error(f"[STATION]: ADD ERROR: {e}")
-                        db.session.rollback()
-                        station = None
-
-        if station:
-            properties = feature.get("properties")
-
-            for key in list(properties):
-                if rename_columns.get(key):
-                    new_col_name = rename_columns.get(key)
-                    properties.update({new_col_name: properties[key]})
-
-            exists = False
-            obs = Observation.query.filter_by(wigos_id=wigos_id, time=properties.get("time")).first()
-
-            if obs:
-                exists = True
-                for key, val in properties.items():
-                    if hasattr(obs, key):
-                        setattr(obs, key, val)
-            else:
-                obs = Observation(**properties, wigos_id=station.wigos_id)
+    load_obs_from_rows([feature_to_row(feature) for feature in geojson.get("features")])
 
-            try:
-                if not exists:
-                    logging.info('[OBSERVATION]: ADD')
-                    db.session.add(obs)
-                else:
-                    logging.info('[OBSERVATION]: UPDATE')
 
-                db.session.commit()
+def load_station_map():
+    station_map = {wigos_id: wigos_id for wigos_id, in db.session.query(Station.wigos_id)}
+
+    for wigos_id, identifier in db.session.query(StationIdentifier.wigos_id, StationIdentifier.identifier):
+        station_map.setdefault(identifier, wigos_id)
+
+    logging.info(f"[STATION]: Loaded {len(station_map)} station identifiers")
+
+    return station_map
+
+
+def insert_stations(stations):
+    if not stations:
+        return
+
+    table = Station.__table__
+
+    values = [{
+        **station,
+        "geom": func.ST_SetSRID(func.ST_Point(station.get("longitude"), station.get("latitude")), 4326)
+    } for station in stations]
+
+    logging.info(f'[STATION]: ADD {len(values)} stations')
+
+    with db.session.begin_nested():
+        db.session.execute(insert(table).values(values).on_conflict_do_nothing(index_elements=["wigos_id"]))
 
+
+def observation_record(row, wigos_id):
+    properties = {rename_columns.get(key, key): val for key, val in row.items() if key not in station_columns}
+
+    record = {column: properties.get(column) for column in observation_fields}
+    record["wigos_id"] = wigos_id
+
+    return record
+
+
+def upsert_observations_statement(records):
+    table = Observation.__table__
+
+    stmt = insert(table).values(records)
+
+    # keep existing values for parameters missing from the new records
+    update_columns = {
+        column: func.coalesce(stmt.excluded[column], table.c[column])
+        for column in observation_parameters
+    }
+
+    return stmt.on_conflict_do_update(constraint="unique_station_time", set_=update_columns)
+
+
+def get_observation_partition(month):
+    return f"synop_observation_y{month.year:04d}m{month.month:02d}"
+
+
+def ensure_observation_partitions(times, months_ahead=1):
+    months = set()
+
+    for timestep in times:
+        if isinstance(timestep, str):
+            timestep = datetime.fromisoformat(timestep)
+        month = timestep.date().replace(day=1)
+        months.add(month)
+
+        # create the following partitions ahead of time
+        for _ in range(months_ahead):
+            month = (month + timedelta(days=32)).replace(day=1)
+            months.add(month)
+
+    # DDL on its own connection, so the caller's transaction is neither committed nor
+    # holding the lock on the parent table for the whole load
+    with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        # give up rather than queue behind readers of the parent table, and hold up theirs
+        connection.execute(text(f"SET lock_timeout = '{PARTITION_LOCK_TIMEOUT}'"))
+
+        for month in sorted(months):
+            partition = get_observation_partition(month)
+
+            # checking first avoids taking a lock on the parent table when the partition exists
+            if connection.execute(text("SELECT to_regclass(:name)"), {"name": partition}).scalar():
+                continue
+
+            next_month = (month + timedelta(days=32)).replace(day=1)
+
+            logging.info(f"[OBSERVATION]: Creating partition {partition}")
+            try:
+                connection.execute(text(
+                    f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {Observation.__tablename__} "
+                    f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month.isoformat()}')"
+                ))
             except Exception as e:
-                logging.info('[OBSERVATION]: Error adding or updating')
-                db.session.rollback()
+                # another worker may have created it concurrently
+                logging.warning(f"[OBSERVATION]: Error creating partition {partition}: {e}")
+
+
+def upsert_observations(records):
+    loaded = 0
+    failed = []
+
+    for i in range(0, len(records), OBS_CHUNK_SIZE):
+        chunk = records[i:i + OBS_CHUNK_SIZE]
+
+        try:
+            with db.session.begin_nested():
+                db.session.execute(upsert_observations_statement(chunk))
+            loaded += len(chunk)
+        except Exception as e:
+            logging.warning(f"[OBSERVATION]: Error loading batch, retrying row by row: {e}")
+
+            # isolate the bad rows without rolling back the rest of the batch
+            for record in chunk:
+                try:
+                    with db.session.begin_nested():
+                        db.session.execute(upsert_observations_statement([record]))
+                    loaded += 1
+                except Exception as e:
+                    logging.error(f"[OBSERVATION]: Error loading {record.get('wigos_id')}: {e}")
+                    failed.append({"wigos_id": record.get("wigos_id"), "time": record.get("time"), "error": str(e)})
+
+    return loaded, failed
+
+
+def refresh_timesteps(times):
+    times = {datetime.fromisoformat(t) if isinstance(t, str) else t for t in times}
+
+    if not times:
+        return
+
+    table = Observation.__table__
+
+    # parameters reported by at least one station at the timestep
+    parameter_count = sum(case((func.count(table.c[column]) > 0, 1), else_=0) for column in observation_parameters)
+
+    query = select(
+        table.c.time,
+        func.count(table.c.wigos_id.distinct()),
+        func.count(),
+        parameter_count,
+        func.now(),
+    ).where(table.c.time.in_(times)).group_by(table.c.time)
+
+    stmt = insert(Timestep.__table__).from_select(
+        ["time", "station_count", "observation_count", "parameter_count", "updated_at"], query
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["time"],
+        set_={
+            "station_count": stmt.excluded.station_count,
+            "observation_count": stmt.excluded.observation_count,
+            "parameter_count": stmt.excluded.parameter_count,
+            "updated_at": stmt.excluded.updated_at,
+        }
+    )
+
+    db.session.execute(stmt)
+
+
+def refresh_statistics(times):
+    times = [datetime.fromisoformat(t) if isinstance(t, str) else t for t in times]
+
+    if not times:
+        return
+
+    # one (parameter, value) pair per observation column, aggregated per territory, stations
+    # created at ingest have no territory and are keyed '' so responses keep string keys
+    parameter_values = ", ".join(f"('{column}', o.{column})" for column in observation_parameters)
+
+    db.session.execute(delete(Statistic).where(Statistic.time.in_(times)))
+    db.session.execute(text(f"""
+        INSERT INTO {Statistic.__tablename__} (time, territory, parameter, station_count, minimum, maximum, mean)
+        SELECT o.time, coalesce(s.territory, ''), p.parameter, count(*), min(p.value), max(p.value), avg(p.value)
+        FROM {Observation.__tablename__} o
+        JOIN {Station.__tablename__} s ON s.wigos_id = o.wigos_id
+        CROSS JOIN LATERAL (VALUES {parameter_values}) AS p(parameter, value)
+        WHERE o.time = ANY(:times) AND p.value IS NOT NULL
+        GROUP BY o.time, s.territory, p.parameter
+    """), {"times": times})
+
+
+def get_station_territories():
+    return {wigos_id: territory for wigos_id, territory in db.session.query(Station.wigos_id, Station.territory)}
+
+
+def get_station_timesteps(wigos_ids):
+    # served by unique_station_time, leading on wigos_id
+    query = db.session.query(Observation.time).filter(Observation.wigos_id.in_(wigos_ids)).distinct()
+
+    return sorted(time for time, in query)
+
+
+def refresh_station_statistics(wigos_ids, chunk_size=100):
+    """Recompute the rollups of every timestep observed by stations whose territory changed"""
+    times = get_station_timesteps(wigos_ids)
+
+    for i in range(0, len(times), chunk_size):
+        refresh_statistics(times[i:i + chunk_size])
+
+    return len(times)
+
+
+def bump_generation(name):
+    table = Generation.__table__
+
+    # committed with the data it versions, so readers never see a new marker with old data
+    stmt = insert(table).values(name=name, value=1, updated_at=func.timezone("UTC", func.now()))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["name"],
+        set_={"value": table.c.value + 1, "updated_at": stmt.excluded.updated_at}
+    )
+
+    db.session.execute(stmt)
+
+
+def get_generations(names):
+    return {generation.name: generation for generation in Generation.query.filter(Generation.name.in_(names)).all()}
+
+
+def load_obs_from_rows(rows, station_map=None):
+    if station_map is None:
+        station_map = load_station_map()
+
+    new_stations = {}
+    records = {}
+
+    for row in rows:
+        wigos_id = station_map.get(row.get("wigos_id"))
+
+        if not wigos_id:
+            wigos_id = row.get("wigos_id")
+
+            if not row.get("station_or_site_name") or row.get("longitude") is None or row.get("latitude") is None:
+                continue
+
+            new_stations[wigos_id] = {
+                "wigos_id": wigos_id,
+                "name": row.get("station_or_site_name"),
+                "longitude": row.get("longitude"),
+                "latitude": row.get("latitude"),
+            }
+
+        record = observation_record(row, wigos_id)
+        key = (record["wigos_id"], record["time"])
+
+        # alternate identifiers can resolve several rows to the same station
+        if key in records:
+            records[key].update({k: v for k, v in record.items() if v is not None})
+        else:
+            records[key] = record
+
+    # partitions exist before anything of this timestep is written. the session must not
+    # hold locks on synop_observation meanwhile, the DDL runs on another connection
+    db.session.commit()
+    ensure_observation_partitions({key[1] for key in records})
+
+    try:
+        insert_stations(list(new_stations.values()))
+        station_map.update({wigos_id: wigos_id for wigos_id in new_stations})
+    except Exception as e:
+        logging.error(f"[STATION]: ADD ERROR: {e}")
+        records = {key: record for key, record in records.items() if key[0] not in new_stations}
+
+    records = list(records.values())
+
+    loaded, failed = upsert_observations(records)
+
+    # keep the timestep catalogue and rollups in step with the observations they describe
+    times = {record["time"] for record in records}
+    refresh_timesteps(times)
+    refresh_statistics(times)
+    bump_generation("observations")
+
+    db.session.commit()
+
+    logging.info(f"[OBSERVATION]: Loaded {loaded} observations, {len(failed)} failed")
+
+    return loaded, failed
+
+
+def get_observation_tile(date, z, x, y, parameters=None):
+    tile = db.session.execute(
+        text("SELECT public.synop_obs(:z, :x, :y, :date, CAST(:parameters AS text[]))"),
+        {"z": z, "x": x, "y": y, "date": date, "parameters": parameters or None}
+    ).scalar()
+
+    return bytes(tile or b"")
+
+
+def get_oscar_stations(country_iso, client_class=OSCARClient):
+    cache_file = os.path.join(OSCAR_CACHE_DIR, f"{country_iso}.json")
+
+    if os.path.exists(cache_file) and time.time() - os.path.getmtime(cache_file) < OSCAR_CACHE_TTL:
+        logging.debug(f"[STATIONS_LOADING]: Using cached stations for country {country_iso}")
+        with open(cache_file, "r") as f:
+            return json.load(f)
+
+    logging.info(f"[STATIONS_LOADING]: Fetching stations for country {country_iso}")
+    stations = client_class().get_stations(country=country_iso)
+
+    os.makedirs(OSCAR_CACHE_DIR, exist_ok=True)
+    atomic_write(json.dumps(stations), cache_file)
+
+    return stations
+
+
+def parse_oscar_stations(stations):
+    station_rows = {}
+    identifier_rows = {}
+
+    for station in stations.get("stationSearchResults") or []:
+        wigos_id = station.get("wigosId")
+        longitude = station.get("longitude")
+        latitude = station.get("latitude")
+
+        wigos_station_identifiers = station.get("wigosStationIdentifiers")
+
+        if not wigos_id and wigos_station_identifiers:
+            wigos_id = wigos_station_identifiers[0].get("wigosStationIdentifier")
+
+        # skip stations that can not be stored, so they do not fail the whole batch
+        if not wigos_id or not station.get("name") or longitude is None or latitude is None:
+            continue
+
+        station_rows[wigos_id] = {
+            "wigos_id": wigos_id,
+            "name": station.get("name"),
+            "territory": station.get("territory"),
+            "elevation": station.get("elevation"),
+            "longitude": longitude,
+            "latitude": latitude,
+        }
+
+        for identifier in wigos_station_identifiers or []:
+            station_identifier = identifier.get("wigosStationIdentifier")
+            if not identifier.get("primary") and station_identifier:
+                identifier_rows[station_identifier] = {
+                    "wigos_id": wigos_id,
+                    "identifier": station_identifier
+                }
+
+    return station_rows, identifier_rows
+
+
+def upsert_stations(stations):
+    table = Station.__table__
+    changed = 0
+
+    for i in range(0, len(stations), STATION_CHUNK_SIZE):
+        values = [{
+            **station,
+            "geom": func.ST_SetSRID(func.ST_Point(station.get("longitude"), station.get("latitude")), 4326)
+        } for station in stations[i:i + STATION_CHUNK_SIZE]]
+
+        stmt = insert(table).values(values)
+        columns = ["name", "territory", "elevation", "longitude", "latitude"]
+
+        # only touch stations whose attributes have changed
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["wigos_id"],
+            set_={**{column: stmt.excluded[column] for column in columns}, "geom": stmt.excluded.geom},
+            where=or_(*[table.c[column].is_distinct_from(stmt.excluded[column]) for column in columns])
+        )
+
+        changed += db.session.execute(stmt).rowcount
+
+    return changed
+
+
+def upsert_station_identifiers(identifiers):
+    table = StationIdentifier.__table__
+    changed = 0
+
+    for i in range(0, len(identifiers), STATION_CHUNK_SIZE):
+        stmt = insert(table).values(identifiers[i:i + STATION_CHUNK_SIZE])
+
+        stmt = stmt.on_conflict_do_update(
+            index_elements=["identifier"],
+            set_={"wigos_id": stmt.excluded.wigos_id},
+            where=table.c.wigos_id.is_distinct_from(stmt.excluded.wigos_id)
+        )
+
+        changed += db.session.execute(stmt).rowcount
+
+    return changed
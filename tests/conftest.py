@@ -0,0 +1,4 @@
+import os
+
+# the app is created on import, it only needs a database url to be configured
+os.environ.setdefault("SQLALCHEMY_DATABASE_URI", "postgresql://localhost/synop_test")
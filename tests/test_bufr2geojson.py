@@ -0,0 +1,127 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+pytest.importorskip("eccodes")
+pytest.importorskip("cfunits")
+
+from eccodes import CODES_MISSING_DOUBLE, CODES_MISSING_LONG  # noqa: E402
+
+from synop import bufr2geojson  # noqa: E402
+from synop.bufr2geojson import (BUFRParser, CodeTableIndex, compile_codetables, convert_units,  # noqa: E402
+                                get_conversion, index_messages, transform, transform_file)
+
+# a compressed message with three subsets followed by an uncompressed message with one
+FIXTURE = Path(__file__).parent / "fixtures" / "synop.bufr"
+
+ROW_COLUMNS = {"air_temperature", "dewpoint_temperature", "present_weather", "wind_speed"}
+
+
+@pytest.fixture
+def data():
+    return FIXTURE.read_bytes()
+
+
+def features(collections):
+    return [collection[key]["geojson"] for collection in collections for key in sorted(collection)]
+
+
+def test_index_messages(data):
+    index = index_messages(data)
+
+    assert len(index) == 2
+    assert sum(length for offset, length in index) == len(data)
+
+
+def test_vectorized_decode_matches_subset_decode(data):
+    vectorized = list(transform(data, vectorize=True))
+    per_subset = list(transform(data, vectorize=False))
+
+    assert len(vectorized) == len(per_subset) == 4
+    assert features(vectorized) == features(per_subset)
+
+
+def test_transform_file_matches_transform(data):
+    assert features(transform_file(FIXTURE)) == features(transform(data))
+
+
+def test_decoded_values(data):
+    collections = list(transform(data))
+    values = {}
+    for feature in features(collections):
+        properties = feature["properties"]
+        values[(properties["wigos_station_identifier"], properties["name"])] = properties
+
+    temperature = values[("0-20000-0-06011", "air_temperature")]
+    assert temperature["value"] == pytest.approx(1.0)
+    assert temperature["units"] == "Celsius"
+
+    pressure = values[("0-20000-0-06012", "non_coordinate_pressure")]
+    assert pressure["value"] == pytest.approx(1002.0)
+    assert pressure["units"] == "hPa"
+
+    weather = values[("0-20000-0-06010", "present_weather")]
+    assert weather["value"] == 2
+    assert weather["description"]
+
+    assert values[("0-20000-0-06020", "air_temperature")]["value"] == pytest.approx(10.0)
+
+
+@pytest.mark.parametrize("vectorize", [True, False])
+def test_rows_match_features(data, vectorize):
+    rows = list(transform(data, vectorize=vectorize, columns=ROW_COLUMNS))
+
+    assert len(rows) == 4
+
+    for row, collection in zip(rows, transform(data)):
+        geojson = features([collection])
+        properties = geojson[0]["properties"]
+        longitude, latitude, elevation = geojson[0]["geometry"]["coordinates"]
+
+        assert row["wigos_id"] == properties["wigos_station_identifier"]
+        assert (row["longitude"], row["latitude"], row["elevation"]) == (longitude, latitude, elevation)
+
+        expected = {
+            feature["properties"]["name"]: feature["properties"]["value"]
+            for feature in geojson if feature["properties"]["name"] in ROW_COLUMNS
+        }
+        assert {key: row[key] for key in ROW_COLUMNS if key in row} == expected
+
+
+def test_get_conversion():
+    scale, offset = get_conversion("K", "Celsius")
+    assert scale == pytest.approx(1.0)
+    assert offset == pytest.approx(-273.15)
+
+    scale, offset = get_conversion("Pa", "hPa")
+    assert scale == pytest.approx(0.01)
+    assert offset == pytest.approx(0.0)
+
+
+def test_convert_units():
+    values = np.array([273.15, 283.65, CODES_MISSING_DOUBLE, CODES_MISSING_LONG])
+
+    converted = convert_units(values, get_conversion("K", "Celsius"))
+
+    assert converted.tolist() == [0.0, 10.5, CODES_MISSING_DOUBLE, CODES_MISSING_LONG]
+
+
+@pytest.mark.skipif(not bufr2geojson.TABLEDIR.is_dir(), reason="ecCodes code tables are not on disk")
+def test_codetable_index_matches_tables(tmp_path, monkeypatch):
+    version = bufr2geojson.BUFR_TABLE_VERSION
+
+    assert compile_codetables(tmp_path, versions=[version]) > 0
+    index = CodeTableIndex(tmp_path)
+
+    assert version in index
+    assert index.get(version, 20003, 999999) is None
+
+    parser = BUFRParser()
+    parser.table_version = version
+
+    # decoded from the table files
+    monkeypatch.setattr(bufr2geojson, "get_codetable_index", lambda: None)
+    expected = [parser.get_code_value("020003", code) for code in range(5)]
+
+    assert [index.get(version, 20003, code) for code in range(5)] == expected
@@ -0,0 +1,29 @@
+from datetime import datetime
+
+import pytest
+
+from synop.dates import parse_date, format_date
+
+
+@pytest.mark.parametrize("value", [
+    "2024-01-01T03:00:00.000Z",
+    "2024-01-01T03:00:00Z",
+    "2024-01-01T03:00:00+00:00",
+    "2024-01-01T04:00:00+01:00",
+    "2024-01-01T03:00:00",
+])
+def test_parse_date(value):
+    assert parse_date(value) == datetime(2024, 1, 1, 3)
+
+
+def test_dates_round_trip():
+    # values returned by /dates are accepted back by the other endpoints
+    date = datetime(2024, 1, 1, 3)
+
+    assert format_date(date) == "2024-01-01T03:00:00.000Z"
+    assert parse_date(format_date(date)) == date
+
+
+def test_parse_invalid_date():
+    with pytest.raises(ValueError):
+        parse_date("not a date")
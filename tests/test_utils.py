@@ -0,0 +1,48 @@
+from sqlalchemy.dialects import postgresql
+
+from synop.utils import (observation_fields, observation_parameters, observation_record,
+                         upsert_observations_statement)
+
+ROW = {
+    "wigos_id": "0-20000-0-06010",
+    "station_or_site_name": "STATION 0",
+    "longitude": 5.25,
+    "latitude": 50.1,
+    "elevation": 100.0,
+    "time": "2024-01-01T03:00:00Z",
+    "air_temperature": 0.0,
+    "24hour_pressure_change": -1.0,
+    "3hour_pressure_change": 0.5,
+}
+
+
+def test_observation_record():
+    record = observation_record(ROW, "0-20000-0-06010")
+
+    assert set(record) == set(observation_fields)
+    assert record["wigos_id"] == "0-20000-0-06010"
+    assert record["time"] == "2024-01-01T03:00:00Z"
+    assert record["air_temperature"] == 0.0
+
+    # decoded names that are not valid attribute names are renamed
+    assert record["pressure_change_24hour"] == -1.0
+    assert record["pressure_change_3hour"] == 0.5
+
+    # parameters missing from the decoded row are still present, as null
+    assert record["wind_speed"] is None
+
+
+def test_observation_record_drops_station_columns():
+    record = observation_record(ROW, "0-20000-0-06010")
+
+    for column in ("station_or_site_name", "longitude", "latitude", "elevation"):
+        assert column not in record
+
+
+def test_upsert_keeps_existing_values():
+    stmt = upsert_observations_statement([observation_record(ROW, "0-20000-0-06010")])
+    sql = str(stmt.compile(dialect=postgresql.dialect()))
+
+    assert "ON CONFLICT ON CONSTRAINT unique_station_time DO UPDATE" in sql
+    for column in observation_parameters:
+        assert f"{column} = coalesce(excluded.{column}, synop_observation.{column})" in sql